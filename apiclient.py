@@ -0,0 +1,115 @@
+import logging
+import random
+import threading
+import time
+from os import getenv
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from dotenv import load_dotenv
+from metrics import upstream_bytes, upstream_requests, upstream_seconds
+from quota import QuotaManager, quota
+
+
+load_dotenv('.env')
+logger = logging.getLogger('search_logger')
+
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+DEFAULT_TIMEOUTS = {
+    '/locations/search': (3.05, 10),
+    '/properties/list': (3.05, 20),
+    '/properties/get-hotel-photos': (3.05, 10),
+}
+
+
+class HotelsClient:
+
+    def __init__(self, api_key: Optional[str], host: str = 'hotels4.p.rapidapi.com', base_url: Optional[str] = None,
+                 timeouts: Optional[Dict[str, Tuple[float, float]]] = None, default_timeout: Tuple = (3.05, 15),
+                 retries: int = 3, backoff: float = 0.5, max_backoff: float = 8.0, pool_size: int = 10,
+                 transport: Optional[BaseAdapter] = None, quota: Optional['QuotaManager'] = None) -> None:
+        self._base_url = (base_url or f'https://{host}').rstrip('/')
+        self._timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self._default_timeout = default_timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._blocked_until = 0.0
+        self._quota = quota
+        self._lock = threading.Lock()
+        self.rate_limit = {}
+        self.session = requests.Session()
+        self.session.headers.update({'x-rapidapi-key': api_key or '', 'x-rapidapi-host': host})
+        self.mount(transport or HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def mount(self, transport: BaseAdapter) -> None:
+        self.session.mount(self._base_url, transport)
+
+    def get(self, endpoint: str, params: Dict, stream: bool = False) -> 'requests.Response':
+        with upstream_seconds.time(endpoint):
+            return self._get(endpoint, params, stream)
+
+    def _get(self, endpoint: str, params: Dict, stream: bool = False) -> 'requests.Response':
+        timeout = self._timeouts.get(endpoint, self._default_timeout)
+        attempt = 0
+        while True:
+            if self._quota is not None:
+                self._quota.acquire(endpoint)
+            self._wait_for_quota()
+            try:
+                response = self.session.get(self._base_url + endpoint, params=params, timeout=timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                upstream_requests.inc(endpoint, 'error')
+                if attempt >= self._retries:
+                    raise
+                delay = self._delay(attempt)
+                logger.warning(f'HotelsClient.get {endpoint}: {err}, retry in {delay:.2f}s')
+            else:
+                upstream_requests.inc(endpoint, response.status_code)
+                self._read_rate_limit(response)
+                if self._quota is not None:
+                    self._quota.observe(response.headers)
+                if response.status_code not in RETRY_STATUSES or attempt >= self._retries:
+                    if stream and response.status_code < 400:
+                        upstream_bytes.inc(endpoint, amount=int(response.headers.get('Content-Length') or 0))
+                    else:
+                        upstream_bytes.inc(endpoint, amount=len(response.content))
+                    return response
+                upstream_bytes.inc(endpoint, amount=len(response.content))
+                delay = self._delay(attempt, response.headers.get('Retry-After'))
+                logger.warning(f'HotelsClient.get {endpoint}: status {response.status_code}, '
+                               f'retry in {delay:.2f}s')
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self._max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0.5, 1.0) * min(self._max_backoff, self._backoff * 2 ** attempt)
+
+    def _read_rate_limit(self, response: 'requests.Response') -> None:
+        remaining = response.headers.get('x-ratelimit-requests-remaining')
+        reset = response.headers.get('x-ratelimit-requests-reset')
+        if remaining is None:
+            return
+        with self._lock:
+            self.rate_limit = {'limit': response.headers.get('x-ratelimit-requests-limit'),
+                               'remaining': remaining, 'reset': reset}
+            if remaining == '0' and reset and reset.isdigit() and int(reset) <= self._max_backoff:
+                self._blocked_until = time.time() + int(reset)
+
+    def _wait_for_quota(self) -> None:
+        delay = self._blocked_until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+client = HotelsClient(getenv('hotelAPIkey'), base_url=getenv('hotels_api_url'),
+                      retries=int(getenv('api_retries', 3)), pool_size=int(getenv('api_pool_size', 10)), quota=quota)
@@ -0,0 +1,255 @@
+import copy
+import email.parser
+import email.policy
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixture(name: str) -> Dict:
+    with open(os.path.join(FIXTURES, name), encoding='utf8') as file:
+        return json.load(file)
+
+
+def read_params(handler: 'BaseHTTPRequestHandler') -> Dict[str, str]:
+    params = {key: values[-1] for key, values in parse_qs(urlsplit(handler.path).query).items()}
+    length = int(handler.headers.get('Content-Length') or 0)
+    body = handler.rfile.read(length) if length else b''
+    content_type = handler.headers.get('Content-Type', '')
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+    elif content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename():
+                params[name] = f'<file {len(part.get_payload(decode=True))} bytes>'
+            else:
+                params[name] = part.get_content()
+    elif body:
+        params.update(json.loads(body))
+    return params
+
+
+class FakeServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, handler: type, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0) -> None:
+        super().__init__((host, port), handler)
+        self.latency = latency
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self) -> 'FakeServer':
+        self._thread = threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, status: int, payload, content_type: str = 'application/json') -> None:
+        body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class HotelsHandler(JSONHandler):
+
+    def do_GET(self) -> None:
+        endpoint = urlsplit(self.path).path
+        params = read_params(self)
+        self.server.count(endpoint)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        route = {'/locations/search': self.server.locations, '/properties/list': self.server.properties,
+                 '/properties/get-hotel-photos': self.server.photos}.get(endpoint)
+        if route is None:
+            return self.reply(404, {'message': f'Endpoint {endpoint} does not exist'})
+        self.reply(200, route(params), 'application/json; charset=utf-8')
+
+
+class FakeHotelsServer(FakeServer):
+
+    def __init__(self, latency: float = 0.0, pages: int = 4, **kwargs) -> None:
+        super().__init__(HotelsHandler, latency, **kwargs)
+        self.pages = pages
+        self._locations = load_fixture('locations_search.json')
+        self._properties = load_fixture('properties_list.json')
+        self._photos = load_fixture('hotel_photos.json')
+
+    def locations(self, params: Dict[str, str]) -> Dict:
+        answer = copy.deepcopy(self._locations)
+        name = params.get('query', '').strip()
+        for group in answer['suggestions']:
+            for entity in group['entities']:
+                entity['caption'] = entity['caption'].replace(entity['name'], name)
+                if entity['type'] == 'CITY':
+                    entity['name'] = name
+        return answer
+
+    def properties(self, params: Dict[str, str]) -> Dict:
+        page = int(params.get('pageNumber', 1))
+        answer = copy.deepcopy(self._properties)
+        body = answer['data']['body']['searchResults']
+        results = []
+        for item in body['results']:
+            price = item['ratePlan']['price']['exactCurrent'] * (1 + 0.15 * (page - 1))
+            item['id'] = item['id'] * 10 + page
+            item['ratePlan']['price']['exactCurrent'] = round(price, 2)
+            item['ratePlan']['price']['current'] = f'${round(price):,}'
+            for landmark in item['landmarks']:
+                distance = float(landmark['distance'].split()[0].replace(',', '.')) + 0.7 * (page - 1)
+                landmark['distance'] = f'{distance:.1f} км'.replace('.', ',')
+            low, high = float(params.get('priceMin') or 0), float(params.get('priceMax') or 'inf')
+            if low <= price <= high:
+                results.append(item)
+        results.sort(key=lambda item: item['ratePlan']['price']['exactCurrent'],
+                     reverse=params.get('sortOrder') == 'PRICE_HIGHEST_FIRST')
+        body['results'] = results[:int(params.get('pageSize') or 25)]
+        body['pagination']['currentPage'] = page
+        if page < self.pages:
+            body['pagination']['nextPageNumber'] = page + 1
+        else:
+            body['pagination'].pop('nextPageNumber', None)
+        return answer
+
+    def photos(self, params: Dict[str, str]) -> Dict:
+        answer = copy.deepcopy(self._photos)
+        answer['hotelId'] = int(params.get('id') or 0)
+        return answer
+
+
+class TelegramHandler(JSONHandler):
+
+    def do_GET(self) -> None:
+        self.handle_call()
+
+    def do_POST(self) -> None:
+        self.handle_call()
+
+    def handle_call(self) -> None:
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        if parts[0] == 'file':
+            self.server.count('download')
+            return self.reply(200, self.server.voice, 'audio/ogg')
+        method = parts[-1]
+        params = read_params(self)
+        self.server.count(method)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        handler = getattr(self.server, f'api_{method}', None)
+        if handler is None:
+            return self.reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'})
+        self.reply(200, {'ok': True, 'result': handler(params)})
+
+
+class FakeTelegramServer(FakeServer):
+
+    def __init__(self, latency: float = 0.0, voice: bytes = b'', **kwargs) -> None:
+        super().__init__(TelegramHandler, latency, **kwargs)
+        self.voice = voice
+        self._chats = {}
+        self._message_id = 0
+        self._cond = threading.Condition()
+
+    def messages(self, chat_id: int) -> List[Dict]:
+        with self._cond:
+            return list(self._chats.get(chat_id, ()))
+
+    def wait_for(self, chat_id: int, predicate: Callable[[Dict], bool], start: int = 0,
+                 timeout: float = 60) -> Optional[Dict]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for entry in self._chats.get(chat_id, [])[start:]:
+                    if predicate(entry):
+                        return entry
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def record(self, chat_id: int, method: str, params: Dict[str, str]) -> Dict:
+        markup = params.get('reply_markup')
+        with self._cond:
+            self._message_id += 1
+            entry = {'time': time.perf_counter(), 'method': method, 'chat_id': chat_id,
+                     'message_id': int(params.get('message_id') or self._message_id),
+                     'text': params.get('text') or params.get('caption') or '',
+                     'markup': json.loads(markup) if markup else None, 'params': params}
+            self._chats.setdefault(chat_id, []).append(entry)
+            self._cond.notify_all()
+        return entry
+
+    @staticmethod
+    def message(entry: Dict) -> Dict:
+        return {'message_id': entry['message_id'], 'date': int(time.time()), 'text': entry['text'],
+                'chat': {'id': entry['chat_id'], 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'bench_bot'}}
+
+    def api_getMe(self, params: Dict) -> Dict:
+        return {'id': 1, 'is_bot': True, 'first_name': 'bench_bot', 'username': 'bench_bot'}
+
+    def api_sendMessage(self, params: Dict) -> Dict:
+        return self.message(self.record(int(params['chat_id']), 'sendMessage', params))
+
+    def api_editMessageText(self, params: Dict) -> Dict:
+        return self.message(self.record(int(params['chat_id']), 'editMessageText', params))
+
+    def api_editMessageReplyMarkup(self, params: Dict) -> Dict:
+        return self.message(self.record(int(params['chat_id']), 'editMessageReplyMarkup', params))
+
+    def api_sendPhoto(self, params: Dict) -> Dict:
+        return self.message(self.record(int(params['chat_id']), 'sendPhoto', params))
+
+    def api_sendMediaGroup(self, params: Dict) -> List[Dict]:
+        entry = self.record(int(params['chat_id']), 'sendMediaGroup', params)
+        return [self.message(entry) for _ in json.loads(params.get('media') or '[]')]
+
+    def api_deleteMessage(self, params: Dict) -> bool:
+        self.record(int(params['chat_id']), 'deleteMessage', params)
+        return True
+
+    def api_answerCallbackQuery(self, params: Dict) -> bool:
+        return True
+
+    def api_getFile(self, params: Dict) -> Dict:
+        return {'file_id': params['file_id'], 'file_unique_id': params['file_id'], 'file_size': len(self.voice),
+                'file_path': f'voice/{params["file_id"]}.oga'}
+
+    def api_setWebhook(self, params: Dict) -> bool:
+        return True
+
+    def api_deleteWebhook(self, params: Dict) -> bool:
+        return True
@@ -0,0 +1,194 @@
+import argparse
+import gc
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from benchmarks.fakeservers import FakeHotelsServer, FakeTelegramServer
+from benchmarks.scenarios import CITY, SCENARIOS, Conversation
+
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+def make_voice() -> bytes:
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return b''
+    result = subprocess.run([ffmpeg, '-loglevel', 'quiet', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=2',
+                             '-c:a', 'libopus', '-f', 'ogg', 'pipe:1'], stdout=subprocess.PIPE, check=False)
+    return result.stdout if result.returncode == 0 else b''
+
+
+class Recorder:
+
+    def __init__(self) -> None:
+        self.steps = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, name: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self.steps.setdefault(name, []).append(seconds)
+            else:
+                self.failures[name] = self.failures.get(name, 0) + 1
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return {name: {'count': len(values), 'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95),
+                       'p99': percentile(values, 0.99), 'max': max(values)}
+                for name, values in sorted(self.steps.items())}
+
+
+def start_bot(args: argparse.Namespace, hotels: 'FakeHotelsServer', telegram: 'FakeTelegramServer', workdir: str):
+    os.environ.update({'my_token': '123456:BENCHMARK', 'hotelAPIkey': 'benchmark', 'hotels_api_url': hotels.url,
+                       'history_db': os.path.join(workdir, 'history.db'), 'sessions_db': '',
+                       'destinations_db': os.path.join(workdir, 'destinations.db'),
+                       'cache_db': '', 'webhook_port': '', 'metrics_port': '', 'quota_db': '',
+                       'quota_per_second': str(args.quota_per_second), 'quota_per_day': '0', 'quota_per_month': '0'})
+    if args.outbound_chat_rate:
+        os.environ['outbound_chat_rate'] = str(args.outbound_chat_rate)
+        os.environ['outbound_chat_burst'] = str(max(3.0, args.outbound_chat_rate))
+    if args.no_cache:
+        os.environ['cache_max_entries'] = '0'
+    import telebot
+    telebot.apihelper.API_URL = telegram.url + '/bot{0}/{1}'
+    telebot.apihelper.FILE_URL = telegram.url + '/file/bot{0}/{1}'
+    import main
+    from speech import recognizer
+    recognizer._recognizer.recognize_google = lambda audio, language=None: CITY
+    return main
+
+
+def run(args: argparse.Namespace) -> Dict:
+    voice = make_voice()
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    if 'voice' in scenarios and not voice:
+        print('ffmpeg with libopus is not available, the voice scenario is skipped', file=sys.stderr)
+        scenarios.remove('voice')
+    hotels = FakeHotelsServer(latency=args.api_latency / 1000, pages=args.pages).start()
+    telegram = FakeTelegramServer(latency=args.telegram_latency / 1000, voice=voice).start()
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    main = start_bot(args, hotels, telegram, workdir)
+    recorder = Recorder()
+    completed = []
+
+    def user(index: int, rounds: int, record, warmup: bool) -> None:
+        conversation = Conversation(main.bot, telegram, chat_id=10_000 + index, timeout=args.timeout)
+        for round_number in range(rounds):
+            scenario = 'lowprice' if warmup else scenarios[(index + round_number) % len(scenarios)]
+            if conversation.run(scenario, record):
+                completed.append(scenario)
+
+    def wave(rounds: int, record, warmup: bool = False) -> float:
+        threads = [threading.Thread(target=user, args=(index, rounds, record, warmup), daemon=True)
+                   for index in range(args.users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    try:
+        wave(1, lambda *item: None, warmup=True)
+        completed.clear()
+        hotels.requests.clear()
+        telegram.requests.clear()
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        elapsed = wave(args.rounds, recorder)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        main.outbox.close()
+        hotels.stop()
+        telegram.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    updates = sum(len(values) for values in recorder.steps.values())
+    return {'users': args.users, 'rounds': args.rounds, 'scenarios': scenarios, 'seconds': elapsed,
+            'conversations': len(completed), 'conversations_per_second': len(completed) / elapsed,
+            'updates_per_second': updates / elapsed, 'steps': recorder.report(), 'failures': recorder.failures,
+            'memory_growth_mb': (current - baseline) / 2 ** 20, 'memory_peak_mb': (peak - baseline) / 2 ** 20,
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'hotels_requests': dict(hotels.requests), 'telegram_requests': dict(telegram.requests)}
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    for name, stats in result['steps'].items():
+        old = baseline.get('steps', {}).get(name)
+        if old and stats['p95'] > old['p95'] * (1 + tolerance) and stats['p95'] - old['p95'] > 0.005:
+            regressions.append(f'{name}: p95 {old["p95"] * 1000:.1f} ms -> {stats["p95"] * 1000:.1f} ms')
+    if result['conversations_per_second'] < baseline.get('conversations_per_second', 0) * (1 - tolerance):
+        regressions.append(f'throughput {baseline["conversations_per_second"]:.2f} -> '
+                           f'{result["conversations_per_second"]:.2f} conversations/s')
+    return regressions
+
+
+def print_report(result: Dict) -> None:
+    print(f'{result["users"]} users x {result["rounds"]} rounds, {result["conversations"]} conversations '
+          f'in {result["seconds"]:.2f} s: {result["conversations_per_second"]:.2f} conversations/s, '
+          f'{result["updates_per_second"]:.1f} updates/s')
+    print(f'{"step":<32}{"count":>7}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+    for name, stats in result['steps'].items():
+        print(f'{name:<32}{stats["count"]:>7}{stats["p50"] * 1000:>10.1f}{stats["p95"] * 1000:>10.1f}'
+              f'{stats["p99"] * 1000:>10.1f}{stats["max"] * 1000:>10.1f}')
+    if result['failures']:
+        print(f'failed steps: {result["failures"]}')
+    print(f'memory growth {result["memory_growth_mb"]:.2f} MB, peak {result["memory_peak_mb"]:.2f} MB, '
+          f'max rss {result["max_rss_mb"]:.1f} MB')
+    print(f'hotels api requests: {result["hotels_requests"]}')
+    print(f'telegram requests: {result["telegram_requests"]}')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Replay scripted conversations against fake hotels and '
+                                                 'Telegram servers.')
+    parser.add_argument('--users', type=int, default=20, help='simulated users talking at the same time')
+    parser.add_argument('--rounds', type=int, default=3, help='conversations per user')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated scenario names')
+    parser.add_argument('--api-latency', type=float, default=50, help='hotels API latency, ms')
+    parser.add_argument('--telegram-latency', type=float, default=20, help='Bot API latency, ms')
+    parser.add_argument('--pages', type=int, default=4, help='result pages served per search')
+    parser.add_argument('--outbound-chat-rate', type=float, default=0,
+                        help='override outbound_chat_rate (messages per second per chat)')
+    parser.add_argument('--quota-per-second', type=float, default=0,
+                        help='hotels API requests per second allowed by the quota manager, 0 for no limit')
+    parser.add_argument('--no-cache', action='store_true', help='disable the hotels API response cache')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for an answer')
+    parser.add_argument('--json', help='write the result to this file')
+    parser.add_argument('--baseline', help='compare with a result written earlier by --json')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as file:
+            json.dump(result, file, ensure_ascii=False, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            return 1
+    return 1 if result['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import argparse
+import copy
+import datetime
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.fakeservers import load_fixture
+from benchmarks.scenarios import CITY
+
+
+def setup(workdir: str) -> Dict[str, Callable[[], object]]:
+    os.environ.update({'history_db': os.path.join(workdir, 'history.db'), 'cache_db': '', 'quota_db': '',
+                       'destinations_db': os.path.join(workdir, 'destinations.db')})
+    from cache import response_cache
+    from historystore import HistoryStore
+    from localeresolver import resolve_locale
+    from listparser import ijson, scan_property_list, stream_property_list
+    from ranking import ranking
+    from searchrequests import Search
+    from searchresults import HotelSet, parse_distance, parse_price
+
+    import requests
+    with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'properties_list.json'), 'rb') as file:
+        raw = file.read()
+    response = requests.Response()
+    response._content, response.encoding = raw, 'utf-8'
+
+    locations = load_fixture('locations_search.json')
+    response_cache.get_or_load('/locations/search', {'query': CITY, 'locale': resolve_locale(CITY)},
+                               lambda: locations)
+    items = load_fixture('properties_list.json')['data']['body']['searchResults']['results']
+    pages = []
+    for page in range(4):
+        for item in copy.deepcopy(items):
+            item['id'] = item['id'] * 10 + page
+            pages.append(item)
+    hotels = [Search._make_hotel(item) for item in pages]
+    hotel_set = HotelSet()
+    for hotel in hotels:
+        hotel_set.append(hotel)
+
+    history = HistoryStore(os.path.join(workdir, 'micro.db'), max_per_user=50, batch_size=1000, flush_interval=3600)
+    now = datetime.datetime.now()
+    for number in range(50):
+        search_id = history.start(1, '/lowprice', (now - datetime.timedelta(hours=number)).strftime('%Y-%m-%d %H:%M'))
+        history.set_town(search_id, CITY)
+        for index, hotel in enumerate(hotels[:10], 1):
+            history.add_result(search_id, f'{index}. {hotel}')
+    history.flush()
+    newest = history.recent(1, 1)[0][0]
+    legacy = os.path.join(workdir, 'legacy')
+    os.mkdir(legacy)
+    with open(os.path.join(legacy, 'User2.txt'), 'w', encoding='utf-8') as file:
+        for number in range(20):
+            created = (now - datetime.timedelta(days=number)).strftime('%Y-%m-%d %H:%M')
+            file.write(f'{created} - /bestdeal. {CITY}\n')
+            file.writelines(f'{index}. {hotel}\n' for index, hotel in enumerate(hotels[:10], 1))
+    migrated = HistoryStore(os.path.join(workdir, 'migrated.db'), batch_size=1000, flush_interval=3600)
+
+    benchmarks = {
+        'search_town': lambda: Search.search_town(CITY),
+        'make_hotel_page': lambda: [Search._make_hotel(item) for item in items],
+        'list_page_json': lambda: [Search._make_hotel(item) for item in
+                                   response.json()['data']['body']['searchResults']['results']],
+        'list_page_scan': lambda: [Search._make_hotel(item) for item in
+                                   scan_property_list(raw.decode())['data']['body']['searchResults']['results']],
+        'parse_price': lambda: [parse_price(text) for text in ('$1,234', '5 432 RUB', '€87.50', '12 345,67 ₽')],
+        'parse_distance': lambda: [parse_distance(text) for text in ('1,2 км', '0.8 miles', '15 km', '3,4 мили')],
+        'set_limits': lambda: (Search.set_limits('50 400'), Search.set_limits('0,5 12'), Search.set_limits('abc')),
+        'hotel_str': lambda: [str(hotel) for hotel in hotels[:25]],
+        'hotelset_filter_top_k': lambda: hotel_set.filter(price=(50, 400), distance=(0.5, 12)).top_k(10),
+        'ranking_rank': lambda: ranking.rank(hotel_set, ('50', '400'), ('0.5', '12'), 10),
+        'history_recent': lambda: history.recent(1, 11),
+        'history_results': lambda: history.results(1, newest),
+        'history_migrate_file': lambda: migrated.migrate(legacy),
+    }
+    if ijson is not None:
+        benchmarks['list_page_stream'] = lambda: [
+            Search._make_hotel(item) for item in
+            stream_property_list(io.BytesIO(raw))['data']['body']['searchResults']['results']]
+    return benchmarks
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> float:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def peak_memory(func: Callable[[], object]) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Microbenchmarks of parsing and history code paths.')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (all by default)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per repetition')
+    parser.add_argument('--memory', action='store_true', help='also report peak allocated memory of one call')
+    parser.add_argument('--json', help='write the result to this file')
+    parser.add_argument('--baseline', help='compare with a result written earlier by --json')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='micro-')
+    try:
+        benchmarks = setup(workdir)
+        unknown = set(args.names) - set(benchmarks)
+        if unknown:
+            parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+        result = {}
+        print(f'{"benchmark":<26}{"us/op":>12}{"ops/s":>14}' + (f'{"peak KiB":>12}' if args.memory else ''))
+        for name, func in benchmarks.items():
+            if args.names and name not in args.names:
+                continue
+            seconds = measure(func, args.repeat, args.min_time)
+            result[name] = seconds
+            line = f'{name:<26}{seconds * 1e6:>12.2f}{1 / seconds:>14.0f}'
+            if args.memory:
+                line += f'{peak_memory(func) / 1024:>12.1f}'
+            print(line)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as file:
+            json.dump(result, file, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as file:
+            baseline = json.load(file)
+        regressions = [f'{name}: {baseline[name] * 1e6:.2f} us -> {seconds * 1e6:.2f} us'
+                       for name, seconds in result.items()
+                       if name in baseline and seconds > baseline[name] * (1 + args.tolerance)]
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import itertools
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import telebot
+
+from benchmarks.fakeservers import FakeTelegramServer
+
+
+CITY = 'Москва'
+_update_ids = itertools.count(1)
+_callback_ids = itertools.count(1)
+
+
+class Step(NamedTuple):
+    name: str
+    kind: str
+    value: object
+    expect: str
+
+
+def text(name: str, value: str, expect: str) -> 'Step':
+    return Step(name, 'text', value, expect)
+
+
+def voice(name: str, transcript: str, expect: str) -> 'Step':
+    return Step(name, 'voice', transcript, expect)
+
+
+def press(name: str, selector: Callable[[List[Dict]], Optional[Dict]], expect: str) -> 'Step':
+    return Step(name, 'press', selector, expect)
+
+
+def button(label: str) -> Callable[[List[Dict]], Optional[Dict]]:
+    return lambda buttons: next((item for item in buttons if item['text'] == label), None)
+
+
+def nth(prefix: str = '', index: int = 0) -> Callable[[List[Dict]], Optional[Dict]]:
+    def select(buttons: List[Dict]) -> Optional[Dict]:
+        found = [item for item in buttons if item.get('callback_data', '').startswith(prefix)]
+        return found[min(index, len(found) - 1)] if found else None
+    return select
+
+
+def search_steps(command: str, city_step: 'Step', extra: List['Step']) -> List['Step']:
+    return [text('command', command, 'В каком городе искать?'),
+            city_step,
+            press('pick_city', nth(), 'Выберите дату ЗАЕЗДА'),
+            press('check_in', nth('calendar_1:DAY', 2), 'Выберите дату ВЫЕЗДА'),
+            press('check_out', nth('calendar_2:DAY', 3), 'Сколько отелей показать?'),
+            text('hotels_number', '10', 'Выберите валюту'),
+            *extra,
+            press('photos_yes', button('да'), 'Сколько фотографий показать?'),
+            text('photos_number', '5', 'Фотографии какого отеля показать?'),
+            press('pick_hotel', nth(), 'Хотите посмотреть фотографии по другому отелю?'),
+            press('photos_no', button('нет'), 'Чем я еще могу Вам помочь?')]
+
+
+SCENARIOS = {
+    'lowprice': search_steps('/lowprice', text('city', CITY, 'Выберите из списка нужный Вам город'),
+                             [text('currency', 'USD', 'Хотите посмотреть фотографии отелей?')]),
+    'highprice': search_steps('/highprice', text('city', CITY, 'Выберите из списка нужный Вам город'),
+                              [text('currency', 'EUR', 'Хотите посмотреть фотографии отелей?')]),
+    'bestdeal': search_steps('/bestdeal', text('city', CITY, 'Выберите из списка нужный Вам город'),
+                             [text('currency', 'USD', 'Введите диапазон цен'),
+                              text('prices', '50 400', 'Введите диапазон расстояния'),
+                              text('distance', '0,5 12', 'Хотите посмотреть фотографии отелей?')]),
+    'voice': search_steps('/lowprice', voice('city', CITY, 'Выберите из списка нужный Вам город'),
+                          [text('currency', 'RUB', 'Хотите посмотреть фотографии отелей?')]),
+    'history': [text('command', '/history', 'Выберите из списка нужный вам запрос'),
+                press('show', nth(), 'Чем я еще могу помочь?')],
+}
+
+
+class Conversation:
+
+    def __init__(self, bot: 'telebot.TeleBot', telegram: 'FakeTelegramServer', chat_id: int,
+                 timeout: float = 60) -> None:
+        self._bot = bot
+        self._telegram = telegram
+        self._chat_id = chat_id
+        self._timeout = timeout
+        self._last = None
+
+    def run(self, scenario: str, record: Callable[[str, float, bool], None]) -> bool:
+        for step in SCENARIOS[scenario]:
+            start_index = len(self._telegram.messages(self._chat_id))
+            update = self._update(step)
+            if update is None:
+                record(f'{scenario}.{step.name}', 0.0, False)
+                return False
+            start = time.perf_counter()
+            self._bot.process_new_updates([update])
+            entry = self._telegram.wait_for(self._chat_id, lambda item: step.expect in item['text'],
+                                            start_index, self._timeout)
+            record(f'{scenario}.{step.name}', (entry['time'] if entry else time.perf_counter()) - start,
+                   entry is not None)
+            if entry is None:
+                return False
+            self._last = entry
+        return True
+
+    def _update(self, step: 'Step') -> Optional['telebot.types.Update']:
+        user = {'id': self._chat_id, 'is_bot': False, 'first_name': f'user{self._chat_id}'}
+        if step.kind == 'press':
+            buttons = [item for row in ((self._last or {}).get('markup') or {}).get('inline_keyboard', [])
+                       for item in row]
+            chosen = step.value(buttons)
+            if chosen is None:
+                return None
+            return telebot.types.Update.de_json({
+                'update_id': next(_update_ids),
+                'callback_query': {'id': str(next(_callback_ids)), 'from': user, 'chat_instance': str(self._chat_id),
+                                   'data': chosen['callback_data'],
+                                   'message': self._telegram.message(self._last)}})
+        message = {'message_id': next(_update_ids), 'date': int(time.time()), 'from': user,
+                   'chat': {'id': self._chat_id, 'type': 'private'}}
+        if step.kind == 'voice':
+            message['voice'] = {'file_id': f'voice{self._chat_id}', 'file_unique_id': f'voice{self._chat_id}',
+                                'duration': 2, 'mime_type': 'audio/ogg', 'file_size': len(self._telegram.voice)}
+        else:
+            message['text'] = step.value
+        return telebot.types.Update.de_json({'update_id': message['message_id'], 'message': message})
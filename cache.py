@@ -0,0 +1,249 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from metrics import cache_lookups
+from sharedstate import state
+
+
+load_dotenv('.env')
+
+DEFAULT_TTLS = {
+    '/locations/search': 24 * 3600,
+    '/properties/list': 10 * 60,
+    '/properties/get-hotel-photos': 24 * 3600,
+}
+
+
+class MemoryBackend:
+
+    def __init__(self, max_entries: int = 2000, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            return item[0], item[1]
+
+    def set(self, key: str, expires: float, value: Any, size: int) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (expires, value, size)
+            self._bytes += size
+            while self._data and (len(self._data) > self._max_entries or self._bytes > self._max_bytes):
+                self._bytes -= self._data.popitem(last=False)[1][2]
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def items(self, prefix: str) -> List[Tuple[str, Any]]:
+        with self._lock:
+            return [(key, item[1]) for key, item in self._data.items() if key.startswith(prefix)]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteBackend:
+
+    def __init__(self, path: str, max_entries: int = 20000) -> None:
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, expires REAL, accessed REAL, value TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            row = self._db.execute('SELECT expires, value FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE cache SET accessed = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+        return row[0], json.loads(row[1])
+
+    def set(self, key: str, expires: float, value: Any, size: int) -> None:
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO cache (key, expires, accessed, value) VALUES (?, ?, ?, ?)',
+                             (key, expires, time.time(), json.dumps(value, ensure_ascii=False)))
+            self._db.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC '
+                             'LIMIT -1 OFFSET ?)', (self._max_entries,))
+            self._db.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._db.commit()
+
+    def items(self, prefix: str) -> List[Tuple[str, Any]]:
+        with self._lock:
+            rows = self._db.execute('SELECT key, value FROM cache WHERE substr(key, 1, ?) = ?',
+                                    (len(prefix), prefix)).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+class StateBackend:
+
+    def __init__(self, state, prefix: str = 'cache:', stale_ttl: int = 24 * 3600) -> None:
+        self._state = state
+        self._prefix = prefix
+        self._stale_ttl = stale_ttl
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        raw = self._state.get(self._prefix + key)
+        if raw is None:
+            return None
+        item = json.loads(raw)
+        return item['expires'], item['value']
+
+    def set(self, key: str, expires: float, value: Any, size: int) -> None:
+        self._state.set(self._prefix + key, json.dumps({'expires': expires, 'value': value}, ensure_ascii=False),
+                        max(1.0, expires - time.time()) + self._stale_ttl)
+
+    def delete(self, key: str) -> None:
+        self._state.delete(self._prefix + key)
+
+    def items(self, prefix: str) -> List[Tuple[str, Any]]:
+        return [(key[len(self._prefix):], json.loads(raw)['value'])
+                for key, raw in self._state.items(self._prefix + prefix)]
+
+    def __len__(self) -> int:
+        return len(self._state.items(self._prefix))
+
+
+class ResponseCache:
+
+    def __init__(self, ttls: Optional[Dict[str, int]] = None, memory: Optional[MemoryBackend] = None,
+                 disk: Optional[SQLiteBackend] = None) -> None:
+        self._ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._memory = memory or MemoryBackend()
+        self._disk = disk
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'shared': 0, 'stale': 0}
+
+    @staticmethod
+    def make_key(endpoint: str, params: Dict) -> str:
+        normalized = sorted((str(key), ' '.join(str(value).split()).lower()) for key, value in params.items()
+                            if value is not None)
+        return endpoint + '?' + json.dumps(normalized, ensure_ascii=False, separators=(',', ':'))
+
+    def get_or_load(self, endpoint: str, params: Dict, loader: Callable[[], Any], stale_ok: bool = False) -> Any:
+        key = self.make_key(endpoint, params)
+        found, value = self._lookup(key)
+        if found:
+            cache_lookups.inc(endpoint, 'hit')
+            return value
+        if stale_ok:
+            found, value = self._lookup_stale(key, endpoint)
+            if found:
+                return value
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = {'event': threading.Event(), 'value': None, 'error': None}
+        if not leader:
+            flight['event'].wait()
+            self._count('shared')
+            cache_lookups.inc(endpoint, 'shared')
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['value']
+        self._count('misses')
+        cache_lookups.inc(endpoint, 'miss')
+        try:
+            value = flight['value'] = loader()
+            self._store(key, endpoint, value)
+            return value
+        except BaseException as err:
+            flight['error'] = err
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight['event'].set()
+
+    def stale(self, endpoint: str, params: Dict) -> Tuple[bool, Any]:
+        return self._lookup_stale(self.make_key(endpoint, params), endpoint)
+
+    def invalidate(self, endpoint: str, params: Dict) -> None:
+        key = self.make_key(endpoint, params)
+        self._memory.delete(key)
+        if self._disk is not None:
+            self._disk.delete(key)
+
+    def values(self, endpoint: str) -> Iterator[Any]:
+        seen = set()
+        for backend in (self._memory, self._disk):
+            if backend is None:
+                continue
+            for key, value in backend.items(endpoint + '?'):
+                if key not in seen:
+                    seen.add(key)
+                    yield value
+
+    def _lookup(self, key: str) -> Tuple[bool, Any]:
+        now = time.time()
+        item = self._memory.get(key)
+        if item is None and self._disk is not None:
+            item = self._disk.get(key)
+            if item is not None and item[0] > now:
+                self._memory.set(key, item[0], item[1], len(json.dumps(item[1], ensure_ascii=False)))
+        if item is None or item[0] <= now:
+            return False, None
+        self._count('hits')
+        return True, item[1]
+
+    def _lookup_stale(self, key: str, endpoint: str) -> Tuple[bool, Any]:
+        item = self._memory.get(key)
+        if item is None and self._disk is not None:
+            item = self._disk.get(key)
+        if item is None:
+            return False, None
+        self._count('stale')
+        cache_lookups.inc(endpoint, 'stale')
+        return True, item[1]
+
+    def _store(self, key: str, endpoint: str, value: Any) -> None:
+        ttl = self._ttls.get(endpoint)
+        if not ttl:
+            return
+        expires = time.time() + ttl
+        self._memory.set(key, expires, value, len(json.dumps(value, ensure_ascii=False)))
+        if self._disk is not None:
+            self._disk.set(key, expires, value, 0)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+
+response_cache = ResponseCache(memory=MemoryBackend(max_entries=int(getenv('cache_max_entries', 2000)),
+                                                    max_bytes=int(getenv('cache_max_bytes', 64 * 1024 * 1024))),
+                               disk=SQLiteBackend(getenv('cache_db')) if getenv('cache_db') else
+                               StateBackend(state) if getenv('state_url') and state.persistent else None)
@@ -0,0 +1,89 @@
+import calendar
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import telebot
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+from telebot_calendar import Calendar, CallbackData, ENGLISH_LANGUAGE, Language
+
+
+class CachedCalendar(Calendar):
+
+    def __init__(self, language: 'Language' = ENGLISH_LANGUAGE, max_items: int = 256, grey_out: bool = True,
+                 disabled_label: str = '·') -> None:
+        super().__init__(language=language)
+        self._language = language
+        self._max_items = max_items
+        self._grey_out = grey_out
+        self._disabled_label = disabled_label
+        self._cache = OrderedDict()
+        self._today = None
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def create_calendar(self, name: str = 'calendar', year: int = None, month: int = None,
+                        min_date: Optional[datetime.date] = None) -> 'InlineKeyboardMarkup':
+        today = datetime.date.today()
+        year, month = year or today.year, month or today.month
+        if not self._grey_out or (min_date is not None and min_date <= datetime.date(year, month, 1)):
+            min_date = None
+        key = (name, year, month, self._language.months, min_date)
+        with self._lock:
+            if self._today != today:
+                self._cache.clear()
+                self._today = today
+            keyboard = self._cache.get(key)
+            if keyboard is not None:
+                self._cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return keyboard
+        keyboard = self._build(name, year, month, today, min_date)
+        with self._lock:
+            self.stats['misses'] += 1
+            self._cache[key] = keyboard
+            while len(self._cache) > self._max_items:
+                self._cache.popitem(last=False)
+        return keyboard
+
+    def calendar_query_handler(self, bot: 'telebot.TeleBot', call: 'telebot.types.CallbackQuery', name: str,
+                               action: str, year: int, month: int, day: int,
+                               min_date: Optional[datetime.date] = None):
+        if action not in ('PREVIOUS-MONTH', 'NEXT-MONTH', 'MONTH'):
+            return super().calendar_query_handler(bot=bot, call=call, name=name, action=action,
+                                                  year=year, month=month, day=day)
+        current = datetime.date(int(year), int(month), 1)
+        if action == 'PREVIOUS-MONTH':
+            current -= datetime.timedelta(days=1)
+        elif action == 'NEXT-MONTH':
+            current += datetime.timedelta(days=31)
+        bot.edit_message_text(text=call.message.text, chat_id=call.message.chat.id,
+                              message_id=call.message.message_id,
+                              reply_markup=self.create_calendar(name=name, year=current.year, month=current.month,
+                                                                min_date=min_date))
+        return None
+
+    def _build(self, name: str, year: int, month: int, today: datetime.date,
+               min_date: Optional[datetime.date]) -> 'InlineKeyboardMarkup':
+        calendar_callback = CallbackData(name, 'action', 'year', 'month', 'day')
+        data_ignore = calendar_callback.new('IGNORE', year, month, '!')
+        keyboard = InlineKeyboardMarkup(row_width=7)
+        keyboard.add(InlineKeyboardButton(f'{self._language.months[month - 1]} {year}',
+                                          callback_data=calendar_callback.new('MONTHS', year, month, '!')))
+        keyboard.add(*[InlineKeyboardButton(day, callback_data=data_ignore) for day in self._language.days])
+        for week in calendar.monthcalendar(year, month):
+            row = []
+            for day in week:
+                if day == 0:
+                    row.append(InlineKeyboardButton(' ', callback_data=data_ignore))
+                elif min_date is not None and datetime.date(year, month, day) < min_date:
+                    row.append(InlineKeyboardButton(self._disabled_label, callback_data=data_ignore))
+                else:
+                    label = f'({day})' if datetime.date(year, month, day) == today else str(day)
+                    row.append(InlineKeyboardButton(label, callback_data=calendar_callback.new('DAY', year, month, day)))
+            keyboard.add(*row)
+        keyboard.add(InlineKeyboardButton('<', callback_data=calendar_callback.new('PREVIOUS-MONTH', year, month, '!')),
+                     InlineKeyboardButton('Cancel', callback_data=calendar_callback.new('CANCEL', year, month, '!')),
+                     InlineKeyboardButton('>', callback_data=calendar_callback.new('NEXT-MONTH', year, month, '!')))
+        return keyboard
@@ -0,0 +1,75 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from os import getenv
+from typing import Callable, Iterator
+
+from dotenv import load_dotenv
+from logpipeline import bind, new_logger
+from metrics import handler_errors, handler_seconds, new_trace_id
+
+
+load_dotenv('.env')
+access_logger = new_logger('access_logger', logging.INFO if getenv('log_access', '1') == '1' else logging.WARNING)
+
+
+def chat_id_of(update) -> int:
+    message = getattr(update, 'message', None) or update
+    return message.chat.id
+
+
+class ConcurrencyLimiter:
+
+    def __init__(self, global_limit: int = 8, per_user_limit: int = 1) -> None:
+        self._global = threading.BoundedSemaphore(global_limit)
+        self._per_user_limit = per_user_limit
+        self._users = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, chat_id: int) -> Iterator[None]:
+        with self._lock:
+            entry = self._users.get(chat_id)
+            if entry is None:
+                entry = self._users[chat_id] = [threading.BoundedSemaphore(self._per_user_limit), 0]
+            entry[1] += 1
+        try:
+            with entry[0], self._global:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._users[chat_id]
+
+    def limit(self, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(update, *args, **kwargs):
+            chat_id = chat_id_of(update)
+            fields = {'user_id': chat_id, 'handler': func.__name__}
+            trace_id = new_trace_id()
+            if trace_id:
+                fields['trace_id'] = trace_id
+            with bind(**fields):
+                start = time.perf_counter()
+                try:
+                    with self.slot(chat_id):
+                        return func(update, *args, **kwargs)
+                except Exception:
+                    handler_errors.inc(func.__name__)
+                    raise
+                finally:
+                    latency = time.perf_counter() - start
+                    handler_seconds.observe(latency, func.__name__)
+                    access_logger.info('handled', extra={'latency': f'{latency:.3f}'})
+        return wrapper
+
+    def active_users(self) -> int:
+        return len(self._users)
+
+
+bot_threads = int(getenv('bot_threads', 8))
+limiter = ConcurrencyLimiter(global_limit=int(getenv('max_concurrent_updates', bot_threads)),
+                             per_user_limit=int(getenv('max_user_updates', 1)))
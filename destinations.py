@@ -0,0 +1,247 @@
+import html
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+
+CONFIDENT = 1.0
+CLOSE = 0.85
+ACCEPTABLE = 0.6
+_tags = re.compile(r'<[^>]+>')
+_separators = re.compile(r'[\s\-‐-―.,\'"`’()]+')
+TRANSLIT = {'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y',
+            'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+            'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '',
+            'э': 'e', 'ю': 'yu', 'я': 'ya', 'і': 'i', 'ї': 'yi', 'є': 'ye', 'ґ': 'g'}
+ENDINGS = ('ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ами', 'ями', 'ий', 'ый', 'ой', 'ей', 'ая', 'яя', 'ое', 'ее',
+           'ые', 'ие', 'ую', 'юю', 'ом', 'ем', 'ах', 'ях', 'а', 'я', 'ы', 'и', 'е', 'у', 'ю', 'ь', 'о')
+
+
+class Destination(NamedTuple):
+    destination_id: str
+    name: str
+    region: str
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', (text or '').lower().replace('ё', 'е'))
+    text = ''.join(char for char in text if not unicodedata.combining(char) or char == '̆')
+    text = unicodedata.normalize('NFKC', text)
+    return ' '.join(_separators.sub(' ', text).split())
+
+
+def transliterate(text: str) -> str:
+    return ''.join(TRANSLIT.get(char, char) for char in text)
+
+
+def stem(text: str) -> str:
+    words = []
+    for word in text.split():
+        for ending in ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= 3:
+                word = word[:-len(ending)]
+                break
+        words.append(word)
+    return ' '.join(words)
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(first: str, second: str, limit: int) -> int:
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, char in enumerate(first, 1):
+        current = [i]
+        for j, other in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def parse_entity(entity: Dict) -> Optional['Destination']:
+    if entity.get('type') != 'CITY' or not entity.get('destinationId') or not entity.get('name'):
+        return None
+    caption = html.unescape(_tags.sub('', entity.get('caption') or ''))
+    parts = [part.strip() for part in caption.split(',')]
+    region = ', '.join(parts[1:]) if len(parts) > 1 else ''
+    return Destination(str(entity['destinationId']), entity['name'].strip(), region)
+
+
+def parse_response(response: Dict) -> List['Destination']:
+    found = []
+    for group in response.get('suggestions', ()):
+        for entity in group.get('entities', ()):
+            destination = parse_entity(entity)
+            if destination is not None:
+                found.append(destination)
+    return found
+
+
+class DestinationIndex:
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._destinations = {}
+        self._keys = {}
+        self._stems = {}
+        self._grams = {}
+        self._sizes = {}
+        self._trie = {}
+        self._confirmed = {}
+        self._lock = threading.RLock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS destinations (destination_id TEXT, name TEXT, region TEXT, '
+                             'updated REAL, PRIMARY KEY (destination_id, name))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS queries (query TEXT, destination_id TEXT, name TEXT, '
+                             'PRIMARY KEY (query, destination_id, name))')
+            self._db.commit()
+            rows = self._db.execute('SELECT destination_id, name, region FROM destinations').fetchall()
+            for row in rows:
+                self._index(Destination(*row))
+            for query, destination_id, name in self._db.execute('SELECT query, destination_id, name FROM queries'):
+                if (destination_id, name) in self._destinations:
+                    self._confirmed.setdefault(query, set()).add((destination_id, name))
+
+    def add(self, destinations: Iterable['Destination']) -> int:
+        added = []
+        with self._lock:
+            for destination in destinations:
+                known = self._destinations.get((destination.destination_id, destination.name))
+                if known != destination:
+                    self._index(destination)
+                    added.append(destination)
+            if added and self._db:
+                self._db.executemany('INSERT OR REPLACE INTO destinations (destination_id, name, region, updated) '
+                                     'VALUES (?, ?, ?, ?)', [(*item, time.time()) for item in added])
+                self._db.commit()
+        return len(added)
+
+    def add_response(self, response: Dict) -> List['Destination']:
+        destinations = parse_response(response)
+        self.add(destinations)
+        return destinations
+
+    def confirm(self, query: str, destinations: Iterable['Destination']) -> None:
+        key = normalize(query)
+        items = {(destination.destination_id, destination.name) for destination in destinations}
+        if not key or not items:
+            return
+        with self._lock:
+            if items <= self._confirmed.get(key, set()):
+                return
+            self._confirmed.setdefault(key, set()).update(items)
+            if self._db:
+                self._db.executemany('INSERT OR IGNORE INTO queries (query, destination_id, name) VALUES (?, ?, ?)',
+                                     [(key, *item) for item in items])
+                self._db.commit()
+
+    def load_seed(self, path: str) -> int:
+        with open(path, encoding='utf8') as file:
+            data = json.load(file)
+        if isinstance(data, dict):
+            return self.add(parse_response(data))
+        return self.add(destination for destination in map(parse_entity, data) if destination is not None)
+
+    def lookup(self, query: str, limit: int = 10) -> List[Tuple['Destination', float]]:
+        variants = {normalize(query)}
+        variants.add(transliterate(next(iter(variants))))
+        variants.discard('')
+        scores = {}
+        with self._lock:
+            for item in self._confirmed.get(normalize(query), ()):
+                scores[item] = 1.0
+            for variant in variants:
+                for key, score in self._candidates(variant):
+                    for item in self._keys.get(key, ()):
+                        if score > scores.get(item, 0.0):
+                            scores[item] = score
+            ranked = sorted(scores.items(), key=lambda pair: (-pair[1], pair[0][1]))[:limit]
+            return [(self._destinations[item], score) for item, score in ranked]
+
+    def match(self, query: str, min_score: float = CONFIDENT,
+              among: Optional[Iterable['Destination']] = None) -> List['Destination']:
+        found = self.lookup(query, limit=50 if among is not None else 10)
+        if among is not None:
+            allowed = set(among)
+            found = [(destination, score) for destination, score in found if destination in allowed]
+        if not found or found[0][1] < min_score:
+            return []
+        best = found[0][1]
+        return [destination for destination, score in found if score >= max(min_score, best - 0.05)]
+
+    def __len__(self) -> int:
+        return len(self._destinations)
+
+    def _index(self, destination: 'Destination') -> None:
+        item = (destination.destination_id, destination.name)
+        self._destinations[item] = destination
+        key = normalize(destination.name)
+        for variant in {key, transliterate(key)}:
+            if item in self._keys.setdefault(variant, set()):
+                continue
+            self._keys[variant].add(item)
+            self._stems.setdefault(stem(variant), set()).add(variant)
+            grams = trigrams(variant)
+            self._sizes[variant] = len(grams)
+            for gram in grams:
+                self._grams.setdefault(gram, set()).add(variant)
+            node = self._trie
+            for char in variant:
+                node = node.setdefault(char, {})
+            node.setdefault('', set()).add(variant)
+
+    def _candidates(self, query: str) -> Iterable[Tuple[str, float]]:
+        if query in self._keys:
+            yield query, 1.0
+        for key in self._stems.get(stem(query), ()):
+            if key != query:
+                yield key, 0.95
+        grams = trigrams(query)
+        shared = {}
+        for gram in grams:
+            for key in self._grams.get(gram, ()):
+                shared[key] = shared.get(key, 0) + 1
+        for key, count in shared.items():
+            score = 2 * count / (len(grams) + self._sizes[key])
+            limit = 1 if len(query) < 8 else 2
+            if len(query) >= 5 and score >= 0.3:
+                distance = edit_distance(query, key, limit)
+                if distance <= limit:
+                    score = max(score, 0.9 if distance == 1 else CLOSE)
+            yield key, score
+        if len(query) >= 3:
+            for key in self._prefixed(query):
+                yield key, 0.5 + 0.35 * len(query) / len(key)
+
+    def _prefixed(self, prefix: str, limit: int = 20) -> List[str]:
+        node = self._trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        found, stack = [], [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            found.extend(node.get('', ()))
+            stack.extend(child for char, child in node.items() if char)
+        return found
+
+
+def build_index(path: Optional[str], seed: Optional[str], responses: Iterable[Dict] = ()) -> 'DestinationIndex':
+    index = DestinationIndex(path)
+    if seed:
+        index.load_seed(seed)
+    for response in responses:
+        index.add_response(response)
+    return index
@@ -0,0 +1,150 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from logpipeline import bind
+from metrics import dialog_steps
+
+
+logger = logging.getLogger('main_logger')
+
+
+class Invalid(ValueError):
+    pass
+
+
+class State(NamedTuple):
+    name: str
+    handler: Callable
+    validate: Optional[Callable[[str, Any], Any]]
+
+
+class DialogMachine:
+
+    def __init__(self, session: Callable[[int], Any], reply: Callable[[int, str], None], state=None, ttl: float = 1800,
+                 max_chats: int = 10000, prefix: str = 'dialog:',
+                 failure: str = 'Непредвиденная ошибка. Повторите запрос сначала.') -> None:
+        self._session = session
+        self._reply = reply
+        self._state = state
+        self._ttl = ttl
+        self._max_chats = max_chats
+        self._prefix = prefix
+        self._failure = failure
+        self._states: Dict[str, 'State'] = {}
+        self._records: 'OrderedDict[int, Tuple[str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def state(self, name: str, validate: Optional[Callable[[str, Any], Any]] = None) -> Callable[[Callable], Callable]:
+        def register(handler: Callable) -> Callable:
+            if name in self._states:
+                raise ValueError(f'dialog state {name!r} is already registered')
+            self._states[name] = State(name, handler, validate)
+            return handler
+        return register
+
+    def enter(self, chat_id: int, name: str) -> None:
+        if name not in self._states:
+            raise KeyError(f'unknown dialog state {name!r}')
+        expires = time.time() + self._ttl
+        with self._lock:
+            self._records.pop(chat_id, None)
+            self._records[chat_id] = (name, expires)
+            self._trim(time.time())
+        if self._state is not None:
+            self._state.set(f'{self._prefix}{chat_id}', json.dumps({'state': name, 'expires': expires}), self._ttl)
+
+    def finish(self, chat_id: int) -> None:
+        with self._lock:
+            self._records.pop(chat_id, None)
+        if self._state is not None:
+            self._state.delete(f'{self._prefix}{chat_id}')
+
+    def current(self, chat_id: int) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            record = self._records.get(chat_id)
+        if record is None and self._state is not None:
+            record = self._load(chat_id)
+        if record is None:
+            return None
+        if record[1] <= now:
+            dialog_steps.inc(record[0], 'expired')
+            self.finish(chat_id)
+            return None
+        return record[0]
+
+    def active(self, message) -> bool:
+        message.dialog_state = self.current(message.chat.id)
+        return message.dialog_state is not None
+
+    def dispatch(self, message) -> bool:
+        chat_id = message.chat.id
+        name = message.dialog_state if hasattr(message, 'dialog_state') else self.current(chat_id)
+        if name is None:
+            return False
+        state = self._states[name]
+        with bind(handler=name):
+            session = self._session(chat_id)
+            value = message.text
+            if state.validate is not None:
+                try:
+                    value = state.validate(message.text or '', session)
+                except Invalid as err:
+                    logger.warning(f'From User {chat_id}: {message.text} - {err}')
+                    dialog_steps.inc(name, 'invalid')
+                    self._reply(chat_id, str(err))
+                    self.enter(chat_id, name)
+                    return True
+            try:
+                following = state.handler(message, session, value)
+            except Exception as err:
+                logger.critical(f'From User {chat_id}: {message.text} - {err}')
+                dialog_steps.inc(name, 'failed')
+                self.finish(chat_id)
+                self._reply(chat_id, self._failure)
+                return True
+        dialog_steps.inc(name, 'ok')
+        if following is None:
+            with self._lock:
+                unchanged = self._records.get(chat_id, ('',))[0] == name
+            if unchanged:
+                self.finish(chat_id)
+        else:
+            self.enter(chat_id, following)
+        return True
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            self._trim(time.time())
+            counts = {name: 0 for name in self._states}
+            for name, _ in self._records.values():
+                counts[name] += 1
+        return counts
+
+    def _load(self, chat_id: int) -> Optional[Tuple[str, float]]:
+        raw = self._state.get(f'{self._prefix}{chat_id}')
+        if raw is None:
+            return None
+        try:
+            data = json.loads(raw)
+            record = (data['state'], float(data['expires']))
+        except (ValueError, KeyError, TypeError) as err:
+            logger.error(f'Dialog._load: chat {chat_id} - {err}')
+            return None
+        if record[0] not in self._states:
+            return None
+        with self._lock:
+            self._records[chat_id] = record
+            self._trim(time.time())
+        return record
+
+    def _trim(self, now: float) -> None:
+        while self._records:
+            chat_id, (name, expires) = next(iter(self._records.items()))
+            if expires > now and len(self._records) <= self._max_chats:
+                break
+            self._records.popitem(last=False)
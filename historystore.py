@@ -0,0 +1,176 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from os import getenv
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from searchrequests import new_logger
+from sharedstate import shard_count, shard_index
+
+
+load_dotenv('.env')
+logger = new_logger('history_logger', logging.WARNING)
+
+
+class HistoryStore:
+
+    def __init__(self, path: str = 'history.db', max_per_user: int = 50, max_age_days: int = 180,
+                 batch_size: int = 50, flush_interval: float = 2.0, shard_index: int = 0,
+                 shard_count: int = 1) -> None:
+        self._max_per_user = max_per_user
+        self._max_age_days = max_age_days
+        self._batch_size = batch_size
+        self._pending = []
+        self._touched = set()
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS searches (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, '
+                         'created TEXT NOT NULL, command TEXT, town TEXT, results TEXT NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS searches_user_created ON searches (user_id, created DESC)')
+        self._db.commit()
+        self._next_id = (self._db.execute('SELECT MAX(id) FROM searches').fetchone()[0] or 0) + 1
+        self._next_id += (shard_index - self._next_id) % shard_count
+        self._id_step = shard_count
+        self._open = {}
+        self._flush_interval = flush_interval
+        threading.Thread(target=self._run_flusher, name='history-flusher', daemon=True).start()
+        atexit.register(self.close)
+
+    def start(self, user_id: int, command: str, created: Optional[str] = None) -> int:
+        with self._lock:
+            search_id = self._next_id
+            self._next_id += self._id_step
+            record = {'id': search_id, 'user_id': user_id, 'command': command, 'town': None, 'results': [],
+                      'created': created or datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}
+            self._open[search_id] = record
+            self._queue(record)
+            return search_id
+
+    def set_town(self, search_id: int, town: str) -> None:
+        self._update(search_id, town=town)
+
+    def add_result(self, search_id: int, text: str) -> None:
+        self._update(search_id, result=text)
+
+    def recent(self, user_id: int, limit: int = 10, offset: int = 0) -> List[Tuple[int, str]]:
+        self.flush()
+        with self._lock:
+            rows = self._db.execute("SELECT id, created, command, town FROM searches "
+                                    "WHERE user_id = ? AND results != '[]' ORDER BY created DESC, id DESC "
+                                    "LIMIT ? OFFSET ?", (user_id, limit, offset)).fetchall()
+        return [(row[0], self.title(row[1], row[2], row[3])) for row in rows]
+
+    def results(self, user_id: int, search_id: int) -> Optional[Tuple[str, List[str]]]:
+        self.flush()
+        with self._lock:
+            row = self._db.execute('SELECT created, command, town, results FROM searches WHERE id = ? AND user_id = ?',
+                                   (search_id, user_id)).fetchone()
+        if row is None:
+            return None
+        return self.title(row[0], row[1], row[2]), json.loads(row[3])
+
+    @staticmethod
+    def title(created: str, command: str, town: Optional[str]) -> str:
+        return f'{created[5:]} - {command}. {town or ""}'.strip()
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [(r['id'], r['user_id'], r['created'], r['command'], r['town'],
+                     json.dumps(r['results'], ensure_ascii=False)) for r in self._pending]
+            self._pending.clear()
+            self._db.executemany('INSERT OR REPLACE INTO searches (id, user_id, created, command, town, results) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._prune()
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self.flush()
+                self._db.close()
+                self._db = None
+
+    def migrate(self, directory: str = 'history') -> int:
+        count = 0
+        for filename in sorted(os.listdir(directory)):
+            match = re.fullmatch(r'User(\d+)\.txt', filename)
+            if not match:
+                continue
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as history:
+                search_id = None
+                for text in history:
+                    text = text.strip()
+                    header = re.match(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}) - (/\w+)\. ?(.*)', text)
+                    if header:
+                        search_id = self.start(int(match.group(1)), header.group(2), header.group(1))
+                        if header.group(3):
+                            self.set_town(search_id, header.group(3))
+                        count += 1
+                    elif text and search_id is not None:
+                        self.add_result(search_id, text)
+        self._open.clear()
+        self.flush()
+        return count
+
+    def _update(self, search_id: int, town: Optional[str] = None, result: Optional[str] = None) -> None:
+        with self._lock:
+            record = self._open.get(search_id)
+            if record is None:
+                return
+            if town is not None:
+                record['town'] = town
+            if result is not None:
+                record['results'].append(result)
+            self._queue(record)
+
+    def _queue(self, record: dict) -> None:
+        if not any(item is record for item in self._pending):
+            self._pending.append(record)
+        self._touched.add(record['user_id'])
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def _prune(self) -> None:
+        limit = (datetime.datetime.now() - datetime.timedelta(days=self._max_age_days)).strftime('%Y-%m-%d %H:%M')
+        self._db.execute('DELETE FROM searches WHERE created < ?', (limit,))
+        for user_id in self._touched:
+            self._db.execute('DELETE FROM searches WHERE user_id = ? AND id NOT IN (SELECT id FROM searches '
+                             'WHERE user_id = ? ORDER BY created DESC, id DESC LIMIT ?)',
+                             (user_id, user_id, self._max_per_user))
+        self._touched.clear()
+        if len(self._open) > 1000:
+            for search_id in sorted(self._open)[:-1000]:
+                del self._open[search_id]
+
+    def _run_flusher(self) -> None:
+        while self._db is not None:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as err:
+                logger.error(f'HistoryStore.flush: - {err}')
+
+
+history_store = HistoryStore(getenv('history_db', 'history.db'),
+                             max_per_user=int(getenv('history_limit', 50)),
+                             max_age_days=int(getenv('history_days', 180)),
+                             shard_index=shard_index, shard_count=shard_count)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        print(f'Migrated searches: {history_store.migrate(sys.argv[2] if len(sys.argv) > 2 else "history")}')
+    else:
+        print('Usage: python historystore.py migrate [history_dir]')
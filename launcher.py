@@ -0,0 +1,244 @@
+import argparse
+import logging
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+import telebot
+from dotenv import load_dotenv
+
+from logpipeline import new_logger
+from respserver import RespServer
+from webhook import WebhookServer, chat_key, secret_path
+
+
+load_dotenv('.env')
+logger = new_logger('launcher_logger', logging.INFO)
+if os.getenv('telegram_api_url'):
+    telebot.apihelper.API_URL = os.getenv('telegram_api_url').rstrip('/') + '/bot{0}/{1}'
+QUOTAS = {'quota_per_second': 5, 'quota_per_day': 0, 'quota_per_month': 0}
+
+
+class Forwarder:
+
+    def __init__(self, targets: List[str], queue_size: int = 1000, timeout: float = 10,
+                 max_retry_delay: float = 5.0) -> None:
+        self._targets = targets
+        self._timeout = timeout
+        self._max_retry_delay = max_retry_delay
+        self._queues = [queue.Queue(maxsize=max(1, queue_size // len(targets))) for _ in targets]
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {'accepted': 0, 'rejected': 0, 'forwarded': 0, 'retried': 0}
+        self._threads = [threading.Thread(target=self._work, args=(index,), name=f'forward-{index}', daemon=True)
+                         for index in range(len(targets))]
+        for thread in self._threads:
+            thread.start()
+
+    def shard(self, update: Dict) -> int:
+        return chat_key(update) % len(self._targets)
+
+    def submit(self, update: Dict) -> bool:
+        try:
+            self._queues[self.shard(update)].put_nowait(update)
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('accepted')
+        return True
+
+    def depth(self) -> int:
+        return sum(shard.qsize() for shard in self._queues)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return dict(self.stats, depth=self.depth(), targets=len(self._targets))
+
+    def shutdown(self, timeout: float = 10) -> None:
+        deadline = time.time() + timeout
+        while self.depth() and time.time() < deadline:
+            time.sleep(0.1)
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.time()))
+
+    def _work(self, index: int) -> None:
+        session = requests.Session()
+        shard, url = self._queues[index], self._targets[index]
+        while not self._stopped.is_set():
+            try:
+                update = shard.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            delay = 0.1
+            while not self._stopped.is_set():
+                try:
+                    response = session.post(url, json=update, timeout=self._timeout)
+                    if response.status_code == 200:
+                        self._count('forwarded')
+                        break
+                    reason = f'status {response.status_code}'
+                except requests.RequestException as err:
+                    reason = str(err)
+                self._count('retried')
+                logger.warning(f'Forwarder {url}: update {update.get("update_id")} - {reason}, retry in {delay:.1f}s')
+                self._stopped.wait(delay)
+                delay = min(delay * 2, self._max_retry_delay)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+
+class Worker:
+
+    def __init__(self, index: int, env: Dict[str, str]) -> None:
+        self.index = index
+        self._env = env
+        self._process: Optional[subprocess.Popen] = None
+        self.restarts = 0
+
+    def start(self) -> None:
+        self._process = subprocess.Popen([sys.executable, 'main.py'], env=self._env,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    def check(self) -> None:
+        if self._process is not None and self._process.poll() is not None:
+            logger.error(f'Launcher: worker {self.index} exited with {self._process.returncode}, restarting')
+            self.restarts += 1
+            self.start()
+
+    def stop(self, timeout: float = 30) -> None:
+        if self._process is None or self._process.poll() is not None:
+            return
+        self._process.terminate()
+        try:
+            self._process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+
+
+def worker_env(index: int, shard_count: int, port: int, args: argparse.Namespace,
+               state_url: str) -> Dict[str, str]:
+    env = dict(os.environ, webhook_port=str(port), webhook_host=args.host, webhook_path=args.path,
+               webhook_url='', webhook_cert='', webhook_key='', state_url=state_url,
+               shard_index=str(index), shard_count=str(shard_count))
+    for name, default in QUOTAS.items():
+        budget = float(os.getenv(name, default))
+        if budget:
+            share = budget / shard_count
+            env[name] = str(share if name == 'quota_per_second' else max(1, int(share)))
+    quota_db = os.getenv('quota_db', 'quota.db')
+    if quota_db:
+        root, ext = os.path.splitext(quota_db)
+        env['quota_db'] = f'{root}-{index}{ext}'
+    root, ext = os.path.splitext(os.getenv('log_file', 'logs.log'))
+    env['log_file'] = f'{root}-{index}{ext}'
+    if os.getenv('metrics_port'):
+        env['metrics_port'] = str(int(os.getenv('metrics_port')) + index - args.shard_offset)
+    return env
+
+
+def poll(token: str, forwarder: 'Forwarder', stopped: threading.Event, timeout: int = 20) -> None:
+    telebot.apihelper.delete_webhook(token)
+    offset = None
+    while not stopped.is_set():
+        try:
+            updates = telebot.apihelper.get_updates(token, offset, 100, timeout + 10, long_polling_timeout=timeout)
+        except Exception as err:
+            logger.error(f'Launcher.poll: - {err}')
+            stopped.wait(3)
+            continue
+        for update in updates:
+            while not forwarder.submit(update):
+                if stopped.wait(0.1):
+                    return
+            offset = update['update_id'] + 1
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Run the bot as several worker processes. Updates are received '
+                                                 'once and forwarded to the worker that owns the chat.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='local worker processes')
+    parser.add_argument('--base-port', type=int, default=8600, help='webhook port of the first local worker')
+    parser.add_argument('--host', default='127.0.0.1', help='address local workers listen on')
+    parser.add_argument('--path', default=os.getenv('webhook_path') or None,
+                        help='update path of the workers and of --listen (default /webhook/<secret derived from '
+                             'the token or webhook_secret>)')
+    parser.add_argument('--target', action='append', default=[],
+                        help='update url of a worker on another host, may be repeated')
+    parser.add_argument('--state', default=os.getenv('state_url') or 'sqlite:///state.db',
+                        help='shared state url: sqlite:///file, redis://host:port/db or memory://')
+    parser.add_argument('--resp-port', type=int, default=0,
+                        help='start the built-in Redis stand-in on this port and use it as the shared state')
+    parser.add_argument('--shard-offset', type=int, default=0, help='index of the first local worker')
+    parser.add_argument('--shard-total', type=int, default=0,
+                        help='workers on all hosts (default: local workers plus targets)')
+    parser.add_argument('--listen', type=int, default=0,
+                        help='receive updates by webhook on this port instead of polling')
+    parser.add_argument('--listen-host', default='0.0.0.0')
+    parser.add_argument('--url', help='public url registered as the webhook when --listen is used')
+    parser.add_argument('--no-front', action='store_true',
+                        help='only start the workers, updates are forwarded by a launcher on another host')
+    parser.add_argument('--queue', type=int, default=1000, help='updates waiting to be forwarded')
+    args = parser.parse_args(argv)
+
+    if args.workers < 0 or args.workers + len(args.target) == 0:
+        parser.error('at least one local worker or --target is needed')
+    args.path = args.path or secret_path(os.getenv('my_token', ''), os.getenv('webhook_secret'))
+    state_url = args.state
+    resp_server = None
+    if args.resp_port:
+        resp_server = RespServer(('127.0.0.1', args.resp_port)).start()
+        state_url = resp_server.url
+    shard_total = args.shard_total or args.workers + len(args.target)
+    workers = [Worker(args.shard_offset + i, worker_env(args.shard_offset + i, shard_total, args.base_port + i,
+                                                       args, state_url))
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    logger.info(f'Launcher: {len(workers)} workers on ports {args.base_port}..{args.base_port + args.workers - 1}, '
+                f'state {state_url}')
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopped.set())
+    forwarder = server = None
+    if not args.no_front:
+        targets = [f'http://{args.host}:{args.base_port + i}{args.path}' for i in range(args.workers)] + args.target
+        forwarder = Forwarder(targets, args.queue)
+        token = os.getenv('my_token')
+        if args.listen:
+            server = WebhookServer((args.listen_host, args.listen), args.path, forwarder)
+            threading.Thread(target=server.serve_forever, name='launcher-webhook', daemon=True).start()
+            if args.url:
+                telebot.apihelper.set_webhook(token, url=args.url.rstrip('/') + args.path)
+        else:
+            threading.Thread(target=poll, args=(token, forwarder, stopped), name='launcher-poll',
+                             daemon=True).start()
+    try:
+        while not stopped.wait(1):
+            for worker in workers:
+                worker.check()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if forwarder is not None:
+            forwarder.shutdown()
+            logger.info(f'Launcher: stopped, {forwarder.snapshot()}')
+        for worker in workers:
+            worker.stop()
+        if resp_server is not None:
+            resp_server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import io
+import json
+from json.decoder import WHITESPACE
+from os import getenv
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+load_dotenv('.env')
+_decoder = json.JSONDecoder()
+
+
+def _get(item: Any, *path: Union[str, int]) -> Any:
+    for key in path:
+        if isinstance(item, dict):
+            item = item.get(key)
+        elif isinstance(item, list) and isinstance(key, int) and len(item) > key:
+            item = item[key]
+        else:
+            return None
+    return item
+
+
+def slim_hotel(item: Dict) -> Dict:
+    price = _get(item, 'ratePlan', 'price') or {}
+    address = _get(item, 'address') or {}
+    distance = _get(item, 'landmarks', 0, 'distance')
+    return {'id': item.get('id'), 'name': item.get('name'),
+            'address': {key: address[key] for key in ('streetAddress', 'extendedAddress') if key in address},
+            'landmarks': [{'distance': distance}] if distance is not None else [],
+            'ratePlan': {'price': {key: price[key] for key in ('current', 'exactCurrent') if key in price}}}
+
+
+def wrap(results: List[Dict], pagination: Optional[Dict]) -> Dict:
+    search_results = {'results': results}
+    if pagination:
+        search_results['pagination'] = {key: pagination[key] for key in ('currentPage', 'nextPageNumber')
+                                         if key in pagination}
+    return {'data': {'body': {'searchResults': search_results}}}
+
+
+def _skip(text: str, index: int) -> int:
+    return WHITESPACE.match(text, index).end()
+
+
+def _value_after(text: str, key: str, start: int) -> int:
+    index = text.index(f'"{key}"', start)
+    index = _skip(text, index + len(key) + 2)
+    if text[index] != ':':
+        raise ValueError(f'expected ":" after "{key}" at {index}')
+    return _skip(text, index + 1)
+
+
+def _iter_array(text: str, index: int) -> Iterator[Tuple[Any, int]]:
+    if text[index] != '[':
+        raise ValueError(f'expected "[" at {index}')
+    index = _skip(text, index + 1)
+    if text[index] == ']':
+        return
+    while True:
+        value, index = _decoder.raw_decode(text, index)
+        index = _skip(text, index)
+        yield value, index
+        if text[index] == ']':
+            return
+        if text[index] != ',':
+            raise ValueError(f'expected "," at {index}')
+        index = _skip(text, index + 1)
+
+
+def scan_property_list(text: str) -> Dict:
+    start = _value_after(text, 'searchResults', 0)
+    index = _value_after(text, 'results', start)
+    results = []
+    for item, index in _iter_array(text, index):
+        results.append(slim_hotel(item))
+    pagination = None
+    try:
+        pagination, _ = _decoder.raw_decode(text, _value_after(text, 'pagination', start))
+    except ValueError:
+        pass
+    return wrap(results, pagination if isinstance(pagination, dict) else None)
+
+
+def stream_property_list(source: Union[bytes, BinaryIO]) -> Dict:
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    body = next(ijson.items(source, 'data.body.searchResults', use_float=True), None) or {}
+    return wrap([slim_hotel(item) for item in body.get('results') or ()], body.get('pagination'))
+
+
+def slim_document(document: Dict) -> Dict:
+    body = _get(document, 'data', 'body', 'searchResults') or {}
+    return wrap([slim_hotel(item) for item in body.get('results') or ()], body.get('pagination'))
+
+
+def parse_property_list(content: Union[bytes, str, BinaryIO]) -> Dict:
+    if list_parser == 'ijson' and not isinstance(content, str):
+        return stream_property_list(content)
+    if hasattr(content, 'read'):
+        content = content.read()
+    if list_parser == 'json':
+        return slim_document(json.loads(content))
+    text = content.decode('utf-8') if isinstance(content, bytes) else content
+    try:
+        return scan_property_list(text)
+    except (ValueError, IndexError):
+        return slim_document(json.loads(text))
+
+
+list_parser = getenv('list_parser', 'ijson')
+if list_parser == 'ijson' and ijson is None:
+    list_parser = 'scan'
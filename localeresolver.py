@@ -0,0 +1,61 @@
+import unicodedata
+from functools import lru_cache
+from os import getenv
+
+from dotenv import load_dotenv
+from langdetect import DetectorFactory, detect
+from langdetect.detector_factory import init_factory
+from langdetect.lang_detect_exception import LangDetectException
+
+
+load_dotenv('.env')
+DetectorFactory.seed = 0
+
+DEFAULT_LOCALE = 'en_US'
+SCRIPT_LOCALES = {'CYRILLIC': 'ru_RU', 'LATIN': 'en_US', 'GREEK': 'el_GR', 'HANGUL': 'ko_KR',
+                  'HIRAGANA': 'ja_JP', 'KATAKANA': 'ja_JP', 'CJK': 'zh_CN', 'ARABIC': 'ar_AE',
+                  'HEBREW': 'iw_IL', 'THAI': 'th_TH'}
+LATIN_HINTS = {'ä': 'de_DE', 'ö': 'de_DE', 'ü': 'de_DE', 'ß': 'de_DE', 'ñ': 'es_ES', 'ç': 'fr_FR',
+               'è': 'fr_FR', 'ê': 'fr_FR', 'à': 'fr_FR', 'ã': 'pt_BR', 'õ': 'pt_BR', 'ł': 'pl_PL',
+               'ą': 'pl_PL', 'ę': 'pl_PL', 'ś': 'pl_PL', 'ż': 'pl_PL', 'ř': 'cs_CZ', 'ě': 'cs_CZ',
+               'å': 'sv_SE', 'ø': 'no_NO', 'æ': 'da_DK', 'ı': 'tr_TR', 'ğ': 'tr_TR', 'ş': 'tr_TR'}
+DETECTED_LOCALES = {'en': 'en_US', 'pt': 'pt_BR', 'zh-cn': 'zh_CN', 'zh-tw': 'zh_TW', 'ja': 'ja_JP',
+                    'ko': 'ko_KR', 'sv': 'sv_SE', 'cs': 'cs_CZ', 'da': 'da_DK', 'el': 'el_GR',
+                    'he': 'iw_IL', 'ar': 'ar_AE', 'uk': 'uk_UA', 'et': 'et_EE', 'vi': 'vi_VN'}
+
+
+def script_of(char: str) -> str:
+    name = unicodedata.name(char, '')
+    return name.split(' ', 1)[0] if name else ''
+
+
+def detect_locale(text: str) -> str:
+    try:
+        lang = detect(text)
+    except LangDetectException:
+        return DEFAULT_LOCALE
+    return DETECTED_LOCALES.get(lang, '_'.join([lang.lower(), lang.upper()]))
+
+
+@lru_cache(maxsize=int(getenv('locale_cache_size', 4096)))
+def _resolve(text: str) -> str:
+    scripts = {script_of(char) for char in text if char.isalpha()}
+    if len(scripts) == 1:
+        script = scripts.pop()
+        if script == 'LATIN':
+            for char in text:
+                if char in LATIN_HINTS:
+                    return LATIN_HINTS[char]
+            return SCRIPT_LOCALES[script]
+        if script in SCRIPT_LOCALES:
+            return SCRIPT_LOCALES[script]
+    if not scripts:
+        return DEFAULT_LOCALE
+    return detect_locale(text)
+
+
+def resolve_locale(text: str) -> str:
+    return _resolve(' '.join(text.lower().split()))
+
+
+init_factory()
@@ -0,0 +1,138 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from os import getenv
+from typing import Dict, Iterator
+
+from dotenv import load_dotenv
+
+
+load_dotenv('.env')
+FIELDS = ('trace_id', 'user_id', 'handler', 'latency')
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+_context = threading.local()
+_listeners = {}
+_lock = threading.Lock()
+
+
+@contextmanager
+def bind(**fields) -> Iterator[None]:
+    previous = getattr(_context, 'fields', {})
+    _context.fields = dict(previous, **fields)
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+
+class ContextFilter(logging.Filter):
+
+    def filter(self, record: 'logging.LogRecord') -> bool:
+        for name, value in getattr(_context, 'fields', {}).items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class DuplicateFilter(logging.Filter):
+
+    def __init__(self, interval: float = 60, level: int = logging.ERROR, max_keys: int = 1024) -> None:
+        super().__init__()
+        self._interval = interval
+        self._level = level
+        self._max_keys = max_keys
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: 'logging.LogRecord') -> bool:
+        if record.levelno < self._level or self._interval <= 0:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._seen.get(key, (0.0, 0))
+            if now - last < self._interval:
+                self._seen[key] = (last, suppressed + 1)
+                return False
+            if len(self._seen) >= self._max_keys:
+                self._seen = {key: value for key, value in self._seen.items() if now - value[0] < self._interval}
+            self._seen[key] = (now, 0)
+        if suppressed:
+            record.msg = f'{record.getMessage()} (repeated {suppressed} more times)'
+            record.args = None
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+
+    def format(self, record: 'logging.LogRecord') -> str:
+        text = super().format(record)
+        fields = ' '.join(f'{name}={getattr(record, name)}' for name in FIELDS if hasattr(record, name))
+        return f'{text} [{fields}]' if fields else text
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+
+    dropped = 0
+
+    def enqueue(self, record: 'logging.LogRecord') -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+def file_handler(file: str) -> 'logging.Handler':
+    backups = int(getenv('log_backups', 5))
+    if getenv('log_rotation', 'size') == 'time':
+        handler = logging.handlers.TimedRotatingFileHandler(file, when=getenv('log_when', 'midnight'),
+                                                            backupCount=backups, encoding='utf8', delay=True)
+    else:
+        handler = logging.handlers.RotatingFileHandler(file, maxBytes=int(getenv('log_max_bytes', 10 * 1024 * 1024)),
+                                                       backupCount=backups, encoding='utf8', delay=True)
+    handler.setFormatter(StructuredFormatter(FORMAT))
+    return handler
+
+
+def queue_handler(file: str) -> 'logging.Handler':
+    with _lock:
+        entry = _listeners.get(file)
+        if entry is None:
+            records = queue.Queue(maxsize=int(getenv('log_queue_size', 10000)))
+            listener = logging.handlers.QueueListener(records, file_handler(file), respect_handler_level=False)
+            listener.start()
+            handler = NonBlockingQueueHandler(records)
+            handler.addFilter(ContextFilter())
+            handler.addFilter(DuplicateFilter(interval=float(getenv('log_repeat_interval', 60))))
+            entry = _listeners[file] = (listener, handler)
+        return entry[1]
+
+
+def stop() -> None:
+    with _lock:
+        for listener, _ in _listeners.values():
+            listener.stop()
+        _listeners.clear()
+
+
+def new_logger(name: str, level=logging.ERROR, file: str = '') -> logging:
+    file = file or getenv('log_file', 'logs.log')
+    log = logging.getLogger(name)
+    if log.hasHandlers():
+        log.handlers = []
+    log.setLevel(level)
+    log.addHandler(queue_handler(file))
+    return log
+
+
+def snapshot() -> Dict:
+    with _lock:
+        return {'dropped': NonBlockingQueueHandler.dropped,
+                'queued': {file: entry[0].queue.qsize() for file, entry in _listeners.items()}}
+
+
+atexit.register(stop)
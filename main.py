@@ -1,391 +1,533 @@
-import requests
 import speech_recognition as sr
 import datetime
 import telebot
 import os
-import re
-import subprocess
 import logging
-
-from telebot_calendar import Calendar, CallbackData, RUSSIAN_LANGUAGE
-from searchrequests import Search, new_logger
-from searchresults import city
+from concurrent.futures import Future
+from typing import Iterator, List, Optional, Tuple
+
+from telebot_calendar import CallbackData, RUSSIAN_LANGUAGE
+from calendarcache import CachedCalendar
+from searchrequests import Search, new_logger, photo_prefetcher
+from searchresults import CityResult, Hotel
+from quota import QuotaExceeded, quota
+from sessions import sessions
+from sharedstate import state
+from dialog import DialogMachine, Invalid
+from concurrency import limiter, bot_threads
+from photos import send_album
+from historystore import history_store
+from speech import recognizer, RecognizerBusy, VoiceTooLong
+from webhook import current_dispatcher, run_webhook, secret_path
+from outbound import new_dispatcher
+from router import CallbackRouter
+from cache import response_cache
+import metrics
 from dotenv import load_dotenv
 
 
 load_dotenv('.env')
 token = os.getenv("my_token")
-bot = telebot.TeleBot(token)
+if os.getenv('telegram_api_url'):
+    telebot.apihelper.API_URL = os.getenv('telegram_api_url').rstrip('/') + '/bot{0}/{1}'
+    telebot.apihelper.FILE_URL = os.getenv('telegram_api_url').rstrip('/') + '/file/bot{0}/{1}'
+bot = telebot.TeleBot(token, num_threads=bot_threads)
+outbox = new_dispatcher(bot)
+router = CallbackRouter(bot)
+sessions.on_evict = photo_prefetcher.cancel
 currency = {'USD': 'долларах', 'RUB': 'рублях', 'EUR': 'евро'}
-history_dict = dict()
+quota_reply = 'Сейчас слишком много запросов к сервису поиска отелей. Пожалуйста, повторите запрос немного позже.'
+busy_reply = 'Сейчас обрабатывается слишком много голосовых сообщений, попробуйте немного позже.'
+history_page_size = int(os.getenv('history_page_size', 10))
+results_page_size = int(os.getenv('results_page_size', 5))
 logger = new_logger('main_logger', logging.INFO)
-calendar = Calendar(language=RUSSIAN_LANGUAGE)
+calendar = CachedCalendar(language=RUSSIAN_LANGUAGE, max_items=int(os.getenv('calendar_cache_size', 256)),
+                          grey_out=os.getenv('calendar_grey_out', '1') == '1')
 calendar_1_callback = CallbackData("calendar_1", "action", "year", "month", "day")
 calendar_2_callback = CallbackData("calendar_2", "action", "year", "month", "day")
 
 
+def first_day(city: 'CityResult', name: str) -> datetime.date:
+    today = datetime.date.today()
+    if name == calendar_2_callback.prefix and city.date_arrived:
+        return max(today, datetime.date.fromisoformat(city.date_arrived) + datetime.timedelta(days=1))
+    return today
+
+
+def dates_calendar(city: 'CityResult', name: str) -> 'telebot.types.InlineKeyboardMarkup':
+    day = first_day(city, name)
+    return calendar.create_calendar(name=name, year=day.year, month=day.month, min_date=day)
+
+
 def markup_yes_no() -> 'telebot.types.InlineKeyboardMarkup':
     mrk = telebot.types.InlineKeyboardMarkup(row_width=2)
-    button1 = telebot.types.InlineKeyboardButton("да", callback_data='1yes1')
-    button2 = telebot.types.InlineKeyboardButton("нет", callback_data='2no2')
+    button1 = telebot.types.InlineKeyboardButton("да", callback_data=router.encode('y'))
+    button2 = telebot.types.InlineKeyboardButton("нет", callback_data=router.encode('n'))
     mrk.add(button1, button2)
     return mrk
 
 
+dialogs = DialogMachine(sessions.get, lambda chat_id, text: outbox.send_message(chat_id, text),
+                        state=state if state.persistent else None,
+                        ttl=int(os.getenv('dialog_ttl', os.getenv('session_ttl', 1800))),
+                        max_chats=int(os.getenv('max_dialogs', 10000)))
+
+
+@bot.message_handler(content_types=['voice'])
+@limiter.limit
+def voice_message(message) -> None:
+    try:
+        recognizer.check(message.voice.file_size, message.voice.duration)
+    except VoiceTooLong as err:
+        logger.warning(f"error413 - {err}")
+        outbox.send_message(message.chat.id, 'Голосовое сообщение слишком длинное.')
+        resume_as_text(message, 'error413')
+        return
+    try:
+        recognizer.transcribe(lambda: bot.download_file(bot.get_file(message.voice.file_id).file_path),
+                              lambda future: resume_as_text(message, recognized_text(message, future)))
+    except RecognizerBusy as err:
+        logger.warning(f"error503 - {err}")
+        outbox.send_message(message.chat.id, busy_reply)
+
+
+@bot.message_handler(func=dialogs.active, content_types=['text'])
+def dialog_step(message) -> None:
+    dialogs.dispatch(message)
+
+
 @bot.message_handler(commands=['start'])
 def send_welcome(message: 'telebot.types.Message') -> None:
     print(type(message))
-    bot.send_message(message.from_user.id, 'Здравствуйте! Я - бот компании TooEasyTravel. '
-                                           'Моя функция - помочь Вам найти подходящий отель. '
-                                           'Чтобы просмотреть доступные функции, введите /help.')
+    outbox.send_message(message.from_user.id, 'Здравствуйте! Я - бот компании TooEasyTravel. '
+                                              'Моя функция - помочь Вам найти подходящий отель. '
+                                              'Чтобы просмотреть доступные функции, введите /help.')
 
 
 @bot.message_handler(commands=['help'])
 def send_help(message) -> None:
-    bot.send_message(message.from_user.id, 'Вот список доступных команд:\n'
-                                           '/lowprice - поиск отелей по низким ценам;\n'
-                                           '/highprice - поиск отелей по высоким ценам;\n'
-                                           '/bestdeal - поиск отелей, подходящих по цене и расположению от центра;\n'
-                                           '/history - вывести историю поиска')
+    outbox.send_message(message.from_user.id, 'Вот список доступных команд:\n'
+                                              '/lowprice - поиск отелей по низким ценам;\n'
+                                              '/highprice - поиск отелей по высоким ценам;\n'
+                                              '/bestdeal - поиск отелей, подходящих по цене и расположению от центра;\n'
+                                              '/history - вывести историю поиска')
 
 
 @bot.message_handler(commands=['history'])
+@limiter.limit
 def send_history(message) -> None:
-    path = os.path.abspath(os.path.join('history', 'User' + str(message.from_user.id) + '.txt'))
-    if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as history:
-            count = sum(1 for _ in history)
-            history.seek(0)
-            for i in range(count):
-                text = history.readline()
-                if text.strip():
-                    if re.match(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}', text):
-                        key = str(re.findall(r'\d{2}-\d{2} \d{2}:\d{2}.+', text)[0])
-                        history_dict[key] = []
-                    else:
-                        history_dict[key].append(text)
+    send_history_page(message.from_user.id, 0)
+
+
+def send_history_page(user_id: int, offset: int) -> None:
+    searches = history_store.recent(user_id, history_page_size + 1, offset)
+    if searches:
         keyboard = telebot.types.InlineKeyboardMarkup(row_width=1)
         button_list = list()
-        for key in history_dict.keys():
-            if history_dict[key]:
-                button_list.append(telebot.types.InlineKeyboardButton(text=key, callback_data=key))
+        for search_id, title in searches[:history_page_size]:
+            button_list.append(telebot.types.InlineKeyboardButton(text=title,
+                                                                  callback_data=router.encode('h', search_id)))
+        if len(searches) > history_page_size:
+            button_list.append(telebot.types.InlineKeyboardButton(
+                text='Ранее...', callback_data=router.encode('hm', offset + history_page_size)))
         keyboard.add(*button_list)
-        bot.send_message(message.from_user.id, "Выберите из списка нужный вам запрос:",
-                         reply_markup=keyboard)
+        outbox.send_message(user_id, "Выберите из списка нужный вам запрос:",
+                            reply_markup=keyboard)
     else:
-        bot.send_message(message.from_user.id, 'Вы пока еще ничего не искали. '
-                                               'Введите команду, или /help для вывода доступных команд')
+        outbox.send_message(user_id, 'Вы пока еще ничего не искали. '
+                                     'Введите команду, или /help для вывода доступных команд')
 
 
-@bot.message_handler(content_types=['text', 'voice'])
+@bot.message_handler(content_types=['text'])
+@limiter.limit
 def get_text_messages(message) -> None:
-    if message.voice:
-        message.text = get_audio_messages(message)
+    city = sessions.get(message.chat.id)
     logger.info(f'User {message.from_user.id} write the message {message.text}')
     if message.text == "Привет":
-        bot.send_message(message.from_user.id, "Здравствуй, путешественник! Для просмотра функций введите /help.")
+        outbox.send_message(message.from_user.id, "Здравствуй, путешественник! Для просмотра функций введите /help.")
     elif message.text in ('/lowprice', '/highprice', '/bestdeal'):
         city.clear_hotel_list()
         city.mode_search = message.text
-        now = datetime.datetime.now()
-        Search.history(f'User' + str(message.from_user.id) + '.txt',
-                       f'\n{str(now.strftime("%Y-%m-%d %H:%M"))} - {message.text}. ')
-        bot.send_message(message.chat.id, 'В каком городе искать?')
-        bot.register_next_step_handler(message, choice_town)
+        city.history_id = history_store.start(message.from_user.id, message.text)
+        outbox.send_message(message.chat.id, 'В каком городе искать?')
+        dialogs.enter(message.chat.id, 'town')
     else:
-        bot.send_message(message.from_user.id, "Я Вас не понимаю. Повторите или напишите "
-                                               "/help для просмотра доступных команд.")
+        outbox.send_message(message.from_user.id, "Я Вас не понимаю. Повторите или напишите "
+                                                  "/help для просмотра доступных команд.")
 
 
-@bot.callback_query_handler(func=lambda call: call.data in history_dict.keys())
-def history_show(call) -> None:
-    bot.send_message(call.message.chat.id, call.data)
+@router.route('h')
+@limiter.limit
+def history_show(call, search_id: str) -> None:
     bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id,
                                   reply_markup=None)
-    if len(history_dict[call.data]) > 0:
-        for line in history_dict[call.data]:
-            bot.send_message(call.message.chat.id, line)
-    bot.send_message(call.message.chat.id, 'Чем я еще могу помочь? (/help для вывода доступных команд)')
-
-
-def get_audio_messages(message) -> str:
-    file_info = bot.get_file(message.voice.file_id)
-    file = requests.get(f'https://api.telegram.org/file/bot{token}/{file_info.file_path}')
-    src, dst = 'file.oga', 'file.wav'
-    with open(src, 'wb') as f:
-        f.write(file.content)
-    subprocess.run(['ffmpeg', '-loglevel', 'quiet', '-i', src, '-y', '-fs', '700k', dst])
-    rec = sr.Recognizer()
-    with sr.AudioFile(dst) as source:
-        audio = rec.record(source)
-    os.remove(dst)
-    os.remove(src)
+    search = history_store.results(call.from_user.id, int(search_id))
+    if search is not None:
+        outbox.send_message(call.message.chat.id, search[0])
+        for line in search[1]:
+            outbox.send_message(call.message.chat.id, line)
+    outbox.send_message(call.message.chat.id, 'Чем я еще могу помочь? (/help для вывода доступных команд)')
+
+
+@router.route('hm')
+@limiter.limit
+def history_more(call, offset: str) -> None:
+    bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id,
+                                  reply_markup=None)
+    send_history_page(call.from_user.id, int(offset))
+
+
+def recognized_text(message, future: 'Future') -> str:
     try:
-        msg = rec.recognize_google(audio, language='ru_RU')
-        message.text = msg.capitalize()
+        msg = future.result()
         logger.info(f"Google Speech Recognition thinks User{message.from_user.id} said: {msg}")
+        return msg.capitalize()
     except sr.UnknownValueError:
         logger.error("error403 - Google Speech Recognition could not understand audio")
-        message.text = 'error403'
+        return 'error403'
     except sr.RequestError as e:
         logger.warning(f"error404 - Could not request results from Google Speech Recognition service; {e}")
-        message.text = 'error404'
-    return message.text
+        return 'error404'
+    except Exception as e:
+        logger.error(f"error404 - Could not decode voice message; {e}")
+        return 'error404'
+
 
+def resume_as_text(message, text: str) -> None:
+    message.text, message.voice, message.content_type = text, None, 'text'
+    dispatcher = current_dispatcher()
+    if dispatcher is None:
+        bot.worker_pool.put(bot.process_new_messages, [message])
+    elif not dispatcher.call(message.chat.id, bot.process_new_messages, [message]):
+        logger.warning(f"error503 - update queue of chat {message.chat.id} is full")
+        outbox.send_message(message.chat.id, busy_reply)
 
-def choice_town(message) -> None:
-    if message.voice:
-        message.text = get_audio_messages(message)
+
+@dialogs.state('town')
+@limiter.limit
+def choice_town(message, city: 'CityResult', town: str) -> Optional[str]:
     try:
-        bot.send_message(message.from_user.id, 'Обрабатываю запрос, пожалуйста, подождите...')
-        list_town = Search.search_town(message.text)
-        if not list_town:
-            bot.send_message(message.from_user.id, "Город не найден. Проверьте название или введите другой город:")
-            bot.register_next_step_handler(message, choice_town)
+        outbox.send_message(message.from_user.id, 'Обрабатываю запрос, пожалуйста, подождите...')
+        list_town = Search.search_town(town)
+        if list_town == 'quota':
+            outbox.send_message(message.from_user.id, quota_reply)
+            city.clear_hotel_list()
+        elif not list_town:
+            outbox.send_message(message.from_user.id, "Город не найден. Проверьте название или введите другой город:")
+            return 'town'
         else:
             keyboard = telebot.types.InlineKeyboardMarkup(row_width=1)
             button_list = list()
-            for item in list_town:
-                button_list.append(telebot.types.InlineKeyboardButton(text=', '.join([item[0][0], item[0][1]]),
-                                                            callback_data='<delimiter>'.join([item[0][0], item[1]])))
+            for name, region, destination_id in list_town:
+                button_list.append(telebot.types.InlineKeyboardButton(text=', '.join(filter(None, [name, region])),
+                                                                      callback_data=router.encode('c', name,
+                                                                                                  destination_id)))
             keyboard.add(*button_list)
-            bot.send_message(message.from_user.id, "Выберите из списка нужный Вам город:",
-                             reply_markup=keyboard)
+            outbox.send_message(message.from_user.id, "Выберите из списка нужный Вам город:",
+                                reply_markup=keyboard)
     except Exception as err_town:
         logger.error(err_town)
-        bot.send_message(message.from_user.id, 'Произошла непредвиденная ошибка. Возможно, сервис сейчас недоступен. '
-                                               'Пожалуйста, повторите запрос немного позже.')
+        outbox.send_message(message.from_user.id, 'Произошла непредвиденная ошибка. Возможно, сервис сейчас недоступен. '
+                                                  'Пожалуйста, повторите запрос немного позже.')
         city.clear_hotel_list()
+    return None
 
 
-@bot.callback_query_handler(func=lambda call: call.data.count('<delimiter>') > 0)
-def choose_dates(call) -> None:
-    city.name_town, city.id_location = call.data.split('<delimiter>')[0], call.data.split('<delimiter>')[1]
-    bot.send_message(call.message.chat.id, city.name_town)
-    Search.history(f'User' + str(call.message.chat.id) + '.txt', f'{city.name_town}')
+@router.route('c')
+@limiter.limit
+def choose_dates(call, name_town: str, id_location: str) -> None:
+    city = sessions.get(call.message.chat.id)
+    city.name_town, city.id_location = name_town, id_location
+    outbox.send_message(call.message.chat.id, city.name_town)
+    history_store.set_town(city.history_id, city.name_town)
     bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id,
                                   reply_markup=None)
-    now = datetime.datetime.now()
-    bot.send_message(call.message.chat.id, f"Выберите дату ЗАЕЗДА:",
-                     reply_markup=calendar.create_calendar(name=calendar_1_callback.prefix,
-                                                           year=now.year, month=now.month))
+    outbox.send_message(call.message.chat.id, f"Выберите дату ЗАЕЗДА:",
+                        reply_markup=dates_calendar(city, calendar_1_callback.prefix))
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith(calendar_1_callback.prefix))
+@router.raw(calendar_1_callback.prefix)
+@limiter.limit
 def date_arrived(call: telebot.types.CallbackQuery) -> None:
+    city = sessions.get(call.message.chat.id)
     name, action, year, month, day = call.data.split(calendar_1_callback.sep)
     date = calendar.calendar_query_handler(bot=bot, call=call, name=name, action=action,
-                                           year=year, month=month, day=day)
+                                           year=year, month=month, day=day, min_date=first_day(city, name))
     if action == "DAY":
         city.date_arrived = date.strftime('%Y-%m-%d')
         now = datetime.datetime.now()
         if city.date_arrived < now.strftime('%Y-%m-%d'):
-            bot.send_message(call.message.chat.id, "Ошибка при выборе даты заезда. Следует указывать дату, "
-                                                   "не раньше сегодняшней.",
-                             reply_markup=calendar.create_calendar(name=calendar_1_callback.prefix,
-                                                                   year=now.year, month=now.month))
+            outbox.send_message(call.message.chat.id, "Ошибка при выборе даты заезда. Следует указывать дату, "
+                                                      "не раньше сегодняшней.",
+                                reply_markup=dates_calendar(city, calendar_1_callback.prefix))
         else:
-            bot.send_message(call.message.chat.id, f'Дата заезда: {city.date_arrived}. Выберите дату ВЫЕЗДА:',
-                             reply_markup=calendar.create_calendar(name=calendar_2_callback.prefix,
-                                                                   year=now.year, month=now.month))
+            outbox.send_message(call.message.chat.id, f'Дата заезда: {city.date_arrived}. Выберите дату ВЫЕЗДА:',
+                                reply_markup=dates_calendar(city, calendar_2_callback.prefix))
     elif action == "CANCEL":
-        bot.send_message(call.message.chat.id, 'Запрос был отменен. Введите /help для вывода доступных команд')
+        outbox.send_message(call.message.chat.id, 'Запрос был отменен. Введите /help для вывода доступных команд')
         city.clear_hotel_list()
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith(calendar_2_callback.prefix))
+@router.raw(calendar_2_callback.prefix)
+@limiter.limit
 def date_leave(call: telebot.types.CallbackQuery) -> None:
+    city = sessions.get(call.message.chat.id)
     name, action, year, month, day = call.data.split(calendar_2_callback.sep)
     date = calendar.calendar_query_handler(bot=bot, call=call, name=name, action=action,
-                                           year=year, month=month, day=day)
+                                           year=year, month=month, day=day, min_date=first_day(city, name))
     if action == "DAY":
-        now = datetime.datetime.now()
         city.date_leave = date.strftime('%Y-%m-%d')
         if city.date_leave <= city.date_arrived:
-            bot.send_message(call.message.chat.id, f"Ошибка при выборе дат. Дата выезда должна быть позже даты заезда. "
-                                                   f"({city.date_arrived})",
-                             reply_markup=calendar.create_calendar(name=calendar_2_callback.prefix,
-                                                                   year=now.year, month=now.month))
+            outbox.send_message(call.message.chat.id, f"Ошибка при выборе дат. Дата выезда должна быть позже даты заезда. "
+                                                      f"({city.date_arrived})",
+                                reply_markup=dates_calendar(city, calendar_2_callback.prefix))
         else:
-            bot.send_message(call.message.chat.id,
-                             f'Дата заезда: {city.date_arrived}, дата выезда: {city.date_leave}.'
-                             f'\nСколько отелей показать? (не более 25)')
-            bot.register_next_step_handler(call.message, choice_currency)
+            outbox.send_message(call.message.chat.id,
+                                f'Дата заезда: {city.date_arrived}, дата выезда: {city.date_leave}.'
+                                f'\nСколько отелей показать? (не более 25)')
+            dialogs.enter(call.message.chat.id, 'hotels_number')
     elif action == "CANCEL":
-        bot.send_message(call.message.chat.id, 'Запрос был отменен. Введите /help для вывода доступных команд.')
+        outbox.send_message(call.message.chat.id, 'Запрос был отменен. Введите /help для вывода доступных команд.')
         city.clear_hotel_list()
 
 
-def choice_currency(message) -> None:
-    if message.voice:
-        message.text = get_audio_messages(message)
-    try:
-        if int(message.text):
-            city.num_result = message.text
-            keyboard = telebot.types.ReplyKeyboardMarkup(row_width=1)
-            button_list = list()
-            for item in currency.keys():
-                button_list.append(telebot.types.KeyboardButton(text=item))
-            keyboard.add(*button_list)
-            bot.send_message(message.from_user.id, "Выберите валюту:",
-                             reply_markup=keyboard)
-            if city.mode_search == 'DISTANCE_FROM_LANDMARK':
-                bot.register_next_step_handler(message, input_prices)
-            else:
-                bot.register_next_step_handler(message, show_results)
-    except ValueError as error:
-        logger.error(f'From User {message.from_user.id}: {message.text} - {error}')
-        bot.send_message(message.from_user.id, "Я вас не понимаю. Введите пожалуйста число:")
-        bot.register_next_step_handler(message, choice_currency)
-
-
-def input_prices(message) -> None:
-    if message.voice:
-        message.text = get_audio_messages(message)
-    try:
-        if message.text not in currency.keys():
-            logger.error(f'From User {message.from_user.id}: {message.text} - {ValueError}')
-            bot.send_message(message.from_user.id, "Неверная валюта. Вам необходимо выбрать валюту из списка ниже!")
-            bot.register_next_step_handler(message, input_prices)
-        else:
-            city.currency = message.text
-            bot.send_message(message.from_user.id, f'Введите диапазон цен через пробел в {currency[city.currency]}:',
-                             reply_markup=telebot.types.ReplyKeyboardRemove())
-            bot.register_next_step_handler(message, input_distance)
-    except Exception as error:
-        logger.critical(f'From User {message.from_user.id}: {message.text} - {error}')
-        bot.send_message(message.from_user.id, "Непредвиденная ошибка. Повторите запрос сначала.")
-        city.clear_hotel_list()
+def hotels_number(text: str, city: 'CityResult') -> str:
+    if not text.strip().isdigit() or int(text) <= 0:
+        raise Invalid('Я вас не понимаю. Введите пожалуйста число:')
+    return text.strip()
+
 
+def known_currency(text: str, city: 'CityResult') -> str:
+    if text not in currency.keys():
+        raise Invalid('Неверная валюта. Вам необходимо выбрать валюту из списка ниже!')
+    return text
 
-def input_distance(message) -> None:
-    if message.voice:
-        message.text = get_audio_messages(message)
+
+def prices_range(text: str, city: 'CityResult') -> List:
+    prices_limit = Search.set_limits(text)
+    if not prices_limit:
+        raise Invalid(f'Я вас не понимаю. Необходимо ввести две суммы в {currency[city.currency]}:')
+    return prices_limit
+
+
+def distance_range(text: str, city: 'CityResult') -> List:
+    distance_limit = Search.set_limits(text.replace(',', '.'))
+    if not distance_limit:
+        raise Invalid('Я вас не понимаю. Необходимо ввести два числа в километрах!')
+    return distance_limit
+
+
+@dialogs.state('hotels_number', validate=hotels_number)
+@limiter.limit
+def choice_currency(message, city: 'CityResult', number: str) -> str:
+    city.num_result = number
+    keyboard = telebot.types.ReplyKeyboardMarkup(row_width=1)
+    button_list = list()
+    for item in currency.keys():
+        button_list.append(telebot.types.KeyboardButton(text=item))
+    keyboard.add(*button_list)
+    outbox.send_message(message.from_user.id, "Выберите валюту:",
+                        reply_markup=keyboard)
+    return 'bestdeal_currency' if city.mode_search == 'DISTANCE_FROM_LANDMARK' else 'currency'
+
+
+@dialogs.state('bestdeal_currency', validate=known_currency)
+@limiter.limit
+def input_prices(message, city: 'CityResult', value: str) -> str:
+    city.currency = value
+    outbox.send_message(message.from_user.id, f'Введите диапазон цен через пробел в {currency[city.currency]}:',
+                        reply_markup=telebot.types.ReplyKeyboardRemove())
+    return 'prices'
+
+
+@dialogs.state('prices', validate=prices_range)
+@limiter.limit
+def input_distance(message, city: 'CityResult', prices_limit: List) -> str:
+    city.range_prices = prices_limit
+    outbox.send_message(message.from_user.id, 'Введите диапазон расстояния до центра в километрах:')
+    return 'distance'
+
+
+@dialogs.state('distance', validate=distance_range)
+@limiter.limit
+def show_best_deal(message, city: 'CityResult', distance_limit: List) -> None:
+    outbox.send_message(message.from_user.id, 'Обрабатываю запрос, пожалуйста, подождите...')
+    show_results(message, city, Search.iter_hotels(city, distance_limit))
+
+
+@dialogs.state('currency', validate=known_currency)
+@limiter.limit
+def show_by_price(message, city: 'CityResult', value: str) -> None:
+    city.currency = value
+    outbox.send_message(message.from_user.id, 'Обрабатываю запрос, пожалуйста, подождите...',
+                        reply_markup=telebot.types.ReplyKeyboardRemove())
+    show_results(message, city, Search.iter_hotels(city))
+
+
+def show_results(message, city: 'CityResult', hotels: Iterator['Hotel']) -> None:
+    n = 0
+    first_page = None
+    exhausted = False
     try:
-        prices_limit = Search.set_limits(message.text)
-        if prices_limit:
-            city.range_prices = prices_limit
-            bot.send_message(message.from_user.id, 'Введите диапазон расстояния до центра в километрах:')
-            bot.register_next_step_handler(message, show_results)
-        else:
-            bot.send_message(message.from_user.id, f'Я вас не понимаю. '
-                                                   f'Необходимо ввести две суммы в {currency[city.currency]}:')
-            logger.error(f'From User {message.from_user.id}: {message.text} - {ValueError}')
-            bot.register_next_step_handler(message, input_distance)
-    except Exception as error:
-        logger.critical(f'From User {message.from_user.id}: {message.text} - {error}')
-        bot.send_message(message.from_user.id, "Непредвиденная ошибка. Повторите запрос сначала.")
-
-
-def show_results(message) -> None:
-    if message.voice:
-        message.text = get_audio_messages(message)
-    if city.mode_search == 'DISTANCE_FROM_LANDMARK':
-        distance_limit = Search.set_limits(message.text.replace(',', '.'))
-        if distance_limit:
-            bot.send_message(message.from_user.id, 'Обрабатываю запрос, пожалуйста, подождите...')
-            Search.best_deal(city, distance_limit)
-        else:
-            logger.error(f'From User {message.from_user.id}: {message.text} - {ValueError}')
-            bot.send_message(message.from_user.id, f'Я вас не понимаю. '
-                                                   f'Необходимо ввести два числа в километрах!')
-            bot.register_next_step_handler(message, show_results)
+        for n, hotel in enumerate(hotels, 1):
+            history_store.add_result(city.history_id, ''.join([str(n), '. ', str(hotel)]))
+            if n == results_page_size + 1:
+                first_page = send_results_page(message.chat.id, city, 0, loading=True)
+    except QuotaExceeded:
+        exhausted = True
+    if first_page is not None:
+        update_results_page(message.chat.id, city, first_page)
+    elif n:
+        send_results_page(message.chat.id, city, 0)
+    if n == 0 and exhausted:
+        outbox.send_message(message.from_user.id, quota_reply)
+    elif n == 0:
+        logger.info('Nothing found for request')
+        outbox.send_message(message.from_user.id, 'Извините, по запрашиваемым параметрам ничего не найдено.'
+                                                  'Попробуйте повторить запрос и изменить параметры поиска.')
+        history_store.add_result(city.history_id, 'Ничего не найдено.')
     else:
-        if message.text not in currency.keys():
-            distance_limit = False
-            bot.send_message(message.from_user.id, "Неверная валюта. Вам необходимо выбрать валюту из списка ниже!")
-            bot.register_next_step_handler(message, show_results)
-        else:
-            distance_limit = True
-            keyboard = telebot.types.ReplyKeyboardRemove()
-            city.currency = message.text
-            bot.send_message(message.from_user.id, 'Обрабатываю запрос, пожалуйста, подождите...',
-                             reply_markup=keyboard)
-            Search.search_hotels(city)
-    if distance_limit:
-        if len(city.all_hotels) == 0:
-            logger.info('Nothing found for request')
-            bot.send_message(message.from_user.id, 'Извините, по запрашиваемым параметрам ничего не найдено.'
-                                                   'Попробуйте повторить запрос и изменить параметры поиска.')
-            Search.history(f'User' + str(message.from_user.id) + '.txt', '\nНичего не найдено.')
-        else:
-            n = 1
-            logger.info('Request was already successful')
-            for hotel in city.all_hotels:
-                bot.send_message(message.from_user.id, ''.join([str(n), '. ', str(hotel)]))
-                Search.history(f'User' + str(message.from_user.id) + '.txt', ''.join(['\n', str(n), '. ', str(hotel)]))
-                n += 1
-            else:
-                bot.send_message(message.from_user.id, 'Хотите посмотреть фотографии отелей?',
-                                 reply_markup=markup_yes_no())
-
-
-@bot.callback_query_handler(func=lambda call: call.data in ('1yes1', '2no2'))
+        logger.info('Request was already successful')
+        if exhausted:
+            outbox.send_message(message.from_user.id, quota_reply)
+        photo_prefetcher.prefetch(message.chat.id, [hotel.hotel_id for hotel in city.all_hotels])
+        outbox.send_message(message.from_user.id, 'Хотите посмотреть фотографии отелей?',
+                            reply_markup=markup_yes_no())
+
+
+def results_page(city: 'CityResult', page: int,
+                 loading: bool = False) -> Tuple[str, 'telebot.types.InlineKeyboardMarkup']:
+    hotels = city.all_hotels
+    pages = (len(hotels) + results_page_size - 1) // results_page_size
+    page = max(0, min(page, pages - 1))
+    start = page * results_page_size
+    text = '\n\n'.join(''.join([str(n), '. ', str(hotel)])
+                        for n, hotel in enumerate(hotels[start:start + results_page_size], start + 1))
+    keyboard = telebot.types.InlineKeyboardMarkup(row_width=2)
+    button_list = list()
+    if page > 0:
+        button_list.append(telebot.types.InlineKeyboardButton('« назад',
+                                                              callback_data=router.encode('r', city.history_id, page - 1)))
+    if page < pages - 1:
+        button_list.append(telebot.types.InlineKeyboardButton('далее »',
+                                                              callback_data=router.encode('r', city.history_id, page + 1)))
+    keyboard.add(*button_list)
+    if loading:
+        return f'{text}\n\nСтраница {page + 1}, поиск продолжается...', keyboard
+    return f'{text}\n\nСтраница {page + 1} из {pages}', keyboard
+
+
+def send_results_page(chat_id: int, city: 'CityResult', page: int, loading: bool = False) -> 'Future':
+    text, keyboard = results_page(city, page, loading)
+    return outbox.send_message(chat_id, text, reply_markup=keyboard)
+
+
+def update_results_page(chat_id: int, city: 'CityResult', sent: 'Future') -> None:
+    text, keyboard = results_page(city, 0)
+
+    def edit(future: 'Future') -> None:
+        if future.exception() is None:
+            outbox.call(chat_id, bot.edit_message_text, text, chat_id=chat_id,
+                        message_id=future.result().message_id, reply_markup=keyboard)
+
+    sent.add_done_callback(edit)
+
+
+@router.route('r')
+@limiter.limit
+def turn_results_page(call, history_id: str, page: str) -> None:
+    city = sessions.get(call.message.chat.id)
+    if str(city.history_id) != history_id or not len(city.all_hotels):
+        bot.answer_callback_query(call.id, 'Результаты этого поиска больше недоступны.')
+        return
+    text, keyboard = results_page(city, int(page))
+    outbox.call(call.message.chat.id, bot.edit_message_text, text, chat_id=call.message.chat.id,
+                message_id=call.message.message_id, reply_markup=keyboard)
+    bot.answer_callback_query(call.id)
+
+
+@router.route('y')
+@router.route('n')
+@limiter.limit
 def photo_hotels(call) -> None:
-    if call.data == '1yes1':
-        bot.send_message(call.message.chat.id, 'Сколько фотографий показать? (не больше 7')
-        bot.register_next_step_handler(call.message, number_of_photos)
-    elif call.data == '2no2':
-        bot.send_message(call.message.chat.id, 'Чем я еще могу Вам помочь? (/help для вывода доступных команд.)')
-        city.clear_hotel_list()
+    if call.data == router.encode('y'):
+        outbox.send_message(call.message.chat.id, 'Сколько фотографий показать? (не больше 7')
+        dialogs.enter(call.message.chat.id, 'photos_number')
+    else:
+        outbox.send_message(call.message.chat.id, 'Чем я еще могу Вам помочь? (/help для вывода доступных команд.)')
+        photo_prefetcher.cancel(call.message.chat.id)
     bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id,
                                   reply_markup=None)
 
 
-def number_of_photos(message) -> None:
-    if message.voice:
-        message.text = get_audio_messages(message)
-    if message.text.isdigit():
-        if int(message.text) not in range(1, 8):
-            bot.send_message(message.from_user.id,
-                             'Я могу показать Вам не более 7 фотографий. Введите число от 1 до 7.')
-            bot.register_next_step_handler(message, number_of_photos)
-        else:
-            city.num_result = int(message.text)
-            keyboard = telebot.types.InlineKeyboardMarkup(row_width=1)
-            button_list = list()
-            for item in city.all_hotels:
-                button_list.append(telebot.types.InlineKeyboardButton(text=str(item.name),
-                                                    callback_data='<ph0t0>'.join(str([city.all_hotels.index(item)]))))
-            keyboard.add(*button_list)
-            bot.send_message(message.from_user.id, "Фотографии какого отеля показать?:",
-                             reply_markup=keyboard)
-    else:
-        bot.send_message(message.from_user.id, 'Я вас не понимаю. Необходимо ввести число от 1 до 7!')
-        bot.register_next_step_handler(message, number_of_photos)
-
-
-@bot.callback_query_handler(func=lambda call: call.data.count('<ph0t0>') > 0)
-def show_photo(call) -> None:
-    index = int(call.data.split('<ph0t0>')[1])
-    bot.send_message(call.message.chat.id, city.all_hotels[index].name)
+def photos_number(text: str, city: 'CityResult') -> int:
+    if not text.isdigit():
+        raise Invalid('Я вас не понимаю. Необходимо ввести число от 1 до 7!')
+    if int(text) not in range(1, 8):
+        raise Invalid('Я могу показать Вам не более 7 фотографий. Введите число от 1 до 7.')
+    return int(text)
+
+
+@dialogs.state('photos_number', validate=photos_number)
+@limiter.limit
+def number_of_photos(message, city: 'CityResult', number: int) -> None:
+    city.num_result = number
+    keyboard = telebot.types.InlineKeyboardMarkup(row_width=1)
+    button_list = list()
+    for index, item in enumerate(city.all_hotels):
+        button_list.append(telebot.types.InlineKeyboardButton(text=str(item.name),
+                                                              callback_data=router.encode('f', index)))
+    keyboard.add(*button_list)
+    outbox.send_message(message.from_user.id, "Фотографии какого отеля показать?:",
+                        reply_markup=keyboard)
+
+
+@router.route('f')
+@limiter.limit
+def show_photo(call, index: str) -> None:
+    city = sessions.get(call.message.chat.id)
+    index = int(index)
+    outbox.send_message(call.message.chat.id, city.all_hotels[index].name)
     bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id,
                                   reply_markup=None)
     try:
-        bot.send_message(call.message.chat.id, 'Загружаю фотографии, пожалуйста, подождите...')
+        outbox.send_message(call.message.chat.id, 'Загружаю фотографии, пожалуйста, подождите...')
         Search.show_photos(city.all_hotels[index], city.num_result)
-        for item in city.all_hotels[index].url_photo:
-            file = requests.get(item)
-            img = 'img.jpg'
-            with open(img, 'wb') as f:
-                f.write(file.content)
-            with open('img.jpg', 'rb') as img:
-                bot.send_photo(call.message.chat.id, img, f'{city.all_hotels[index].name}')
-            os.remove('img.jpg')
-        else:
-            bot.send_message(call.message.chat.id, 'Хотите посмотреть фотографии по другому отелю?',
-                             reply_markup=markup_yes_no())
+        if not city.all_hotels[index].url_photo:
+            raise ValueError(f'no photos for hotel {city.all_hotels[index].hotel_id}')
+        outbox.call(call.message.chat.id, send_album, bot, call.message.chat.id,
+                    list(city.all_hotels[index].url_photo), f'{city.all_hotels[index].name}')
+        outbox.send_message(call.message.chat.id, 'Хотите посмотреть фотографии по другому отелю?',
+                            reply_markup=markup_yes_no())
     except Exception as photo_err:
         logger.error(photo_err)
-        bot.send_message(call.message.chat.id, "Фотографий по данному отелю не найдено. "
-                                               "Хотите посмотреть фотографии по другому отелю?",
-                                               reply_markup=markup_yes_no())
+        outbox.send_message(call.message.chat.id, "Фотографий по данному отелю не найдено. "
+                                                  "Хотите посмотреть фотографии по другому отелю?",
+                            reply_markup=markup_yes_no())
+
+
+metrics.registry.collector('outbound', 'Outbound message queue counters.', outbox.snapshot)
+metrics.registry.collector('response_cache', 'Hotels API response cache counters.', response_cache.stats.copy)
+metrics.registry.collector('photo_prefetch', 'Photo prefetch counters.', photo_prefetcher.snapshot)
+metrics.registry.collector('dialogs', 'Chats waiting for an answer by dialog state.', dialogs.snapshot,
+                           label='state')
+metrics.registry.collector('quota', 'Hotels API quota usage and limits.', quota.snapshot)
+metrics.registry.collector('active_users', 'Chats with an update being processed.',
+                           lambda: {'chats': limiter.active_users()})
 
 
 if __name__ == "__main__":
-    while True:
-        try:
-            bot.polling(none_stop=True, interval=0)
-        except Exception as err:
-            logger.fatal(err)
-            city.clear_hotel_list()
+    if os.getenv('metrics_port'):
+        metrics.serve(int(os.getenv('metrics_port')), host=os.getenv('metrics_host', '127.0.0.1'))
+    if os.getenv('webhook_port'):
+        run_webhook(bot, os.getenv('webhook_path') or secret_path(token, os.getenv('webhook_secret')),
+                    host=os.getenv('webhook_host', '0.0.0.0'), port=int(os.getenv('webhook_port')),
+                    url=os.getenv('webhook_url'),
+                    workers=int(os.getenv('webhook_workers', 8)), queue_size=int(os.getenv('webhook_queue', 1000)),
+                    certificate=os.getenv('webhook_cert'), private_key=os.getenv('webhook_key'))
+    else:
+        while True:
+            try:
+                bot.polling(none_stop=True, interval=0)
+            except Exception as err:
+                logger.fatal(err)
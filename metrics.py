@@ -0,0 +1,193 @@
+import bisect
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import getenv
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+
+load_dotenv('.env')
+logger = logging.getLogger('main_logger')
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount: float = 1) -> None:
+        values = tuple(str(value) for value in values)
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def value(self, *values) -> float:
+        return self._values.get(tuple(str(value) for value in values), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f'{self.name}{_labels(self.labels, key)} {value}' for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, amount: float, *values) -> None:
+        values = tuple(str(value) for value in values)
+        with self._lock:
+            entry = self._values.get(values)
+            if entry is None:
+                entry = self._values[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, amount)] += 1
+            entry[1] += amount
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, *values) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *values)
+
+    def count(self, *values) -> int:
+        entry = self._values.get(tuple(str(value) for value in values))
+        return entry[2] if entry else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        names = self.labels + ('le',)
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{self.name}_bucket{_labels(names, key + (le,))} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labels, key)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Registry:
+
+    def __init__(self, prefix: str = 'hotelbot') -> None:
+        self._prefix = prefix
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> 'Counter':
+        return self._register(Counter(f'{self._prefix}_{name}', help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> 'Histogram':
+        return self._register(Histogram(f'{self._prefix}_{name}', help_text, labels, buckets))
+
+    def collector(self, name: str, help_text: str, collect: Callable[[], Dict[str, float]],
+                  label: str = 'name') -> None:
+        with self._lock:
+            self._collectors.append((f'{self._prefix}_{name}', help_text, collect, label))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        for name, help_text, collect, label in collectors:
+            try:
+                values = collect()
+            except Exception as err:
+                logger.warning(f'Metrics.render {name}: - {err}')
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(f'{name}{_labels((label,), (key,))} {value}' for key, value in sorted(values.items())
+                         if isinstance(value, (int, float)))
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        if self.path != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def serve(port: int, host: str = '127.0.0.1') -> 'ThreadingHTTPServer':
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f'Metrics: serving http://{host}:{port}/metrics')
+    return server
+
+
+def new_trace_id() -> Optional[str]:
+    return uuid.uuid4().hex[:16] if tracing else None
+
+
+registry = Registry()
+tracing = getenv('trace_updates', '0') == '1'
+handler_seconds = registry.histogram('handler_seconds', 'Time spent in a conversation step handler.', ('handler',))
+handler_errors = registry.counter('handler_errors_total', 'Conversation steps that raised an exception.',
+                                  ('handler',))
+dialog_steps = registry.counter('dialog_steps_total', 'Dialog answers by state and result.', ('state', 'result'))
+upstream_seconds = registry.histogram('upstream_seconds', 'Duration of hotels API calls including retries.',
+                                      ('endpoint',))
+upstream_requests = registry.counter('upstream_requests_total', 'Hotels API responses by status.',
+                                     ('endpoint', 'status'))
+upstream_bytes = registry.counter('upstream_bytes_total', 'Bytes received from the hotels API.', ('endpoint',))
+quota_requests = registry.counter('quota_requests_total', 'Hotels API quota decisions by priority.',
+                                  ('priority', 'result'))
+cache_lookups = registry.counter('cache_lookups_total', 'Response cache lookups by result.', ('endpoint', 'result'))
+speech_seconds = registry.histogram('speech_seconds', 'Voice message processing time by stage.', ('stage',))
+telegram_seconds = registry.histogram('telegram_seconds', 'Duration of Telegram send calls.', ('method',))
+telegram_calls = registry.counter('telegram_calls_total', 'Telegram send calls by result.', ('method', 'result'))
@@ -0,0 +1,226 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from os import getenv
+from typing import Callable, Dict, List, Optional, Tuple
+
+import telebot
+from dotenv import load_dotenv
+from metrics import telegram_calls, telegram_seconds
+
+
+load_dotenv('.env')
+logger = logging.getLogger('main_logger')
+MAX_TEXT = 4096
+
+
+class TokenBucket:
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens = max(0.0, self.tokens - 1)
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def blocked(self, now: float) -> bool:
+        return now < self.blocked_until
+
+    def idle(self, now: float) -> bool:
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class Job:
+
+    __slots__ = ('func', 'args', 'kwargs', 'future', 'text', 'attempts')
+
+    def __init__(self, func: Callable, args: Tuple, kwargs: Dict, text: Optional[str] = None) -> None:
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.text = text
+        self.attempts = 0
+
+
+class OutboundDispatcher:
+
+    def __init__(self, bot: 'telebot.TeleBot', global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 merge: bool = True, workers: int = 4, max_attempts: int = 5) -> None:
+        self._bot = bot
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._merge = merge
+        self._max_attempts = max_attempts
+        self._queues = {}
+        self._buckets = {}
+        self._ready = OrderedDict()
+        self._busy = set()
+        self._closed = False
+        self._cond = threading.Condition()
+        self.stats = {'sent': 0, 'merged': 0, 'retried': 0, 'failed': 0}
+        self._threads = [threading.Thread(target=self._run, name=f'outbound-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        atexit.register(self.close)
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> 'Future':
+        mergeable = self._merge and not kwargs and len(text) < MAX_TEXT
+        return self._put(chat_id, Job(self._bot.send_message, (chat_id, text), kwargs, text if mergeable else None))
+
+    def call(self, chat_id: int, func: Callable, /, *args, **kwargs) -> 'Future':
+        return self._put(chat_id, Job(func, args, kwargs))
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(jobs) for jobs in self._queues.values())
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self.stats)
+
+    def close(self, timeout: float = 10) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _put(self, chat_id: int, job: 'Job') -> 'Future':
+        with self._cond:
+            self._queues.setdefault(chat_id, deque()).append(job)
+            if chat_id not in self._busy:
+                self._ready[chat_id] = None
+            self._cond.notify()
+        return job.future
+
+    def _pick(self) -> Tuple[Optional[int], Optional[float]]:
+        now = time.monotonic()
+        wait = self._global.wait_time(now)
+        if wait or not self._ready:
+            return None, wait or None
+        for chat_id in self._ready:
+            bucket = self._buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+            chat_wait = bucket.wait_time(now)
+            if chat_wait and not bucket.blocked(now) and len(self._queues[chat_id]) <= self._chat_burst:
+                chat_wait = 0.0
+            if not chat_wait:
+                del self._ready[chat_id]
+                bucket.take()
+                self._global.take()
+                return chat_id, None
+            wait = chat_wait if not wait else min(wait, chat_wait)
+        return None, wait
+
+    def _take(self, chat_id: int) -> List['Job']:
+        jobs = self._queues[chat_id]
+        batch = [jobs.popleft()]
+        if batch[0].text is not None:
+            size = len(batch[0].text)
+            while jobs and jobs[0].text is not None and size + len(jobs[0].text) + 2 <= MAX_TEXT:
+                size += len(jobs[0].text) + 2
+                batch.append(jobs.popleft())
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    chat_id, wait = self._pick()
+                    if chat_id is not None:
+                        break
+                    if self._closed and not self._ready and not self._busy:
+                        return
+                    self._cond.wait(wait if wait is not None else (0.5 if self._closed else None))
+                batch = self._take(chat_id)
+                self._busy.add(chat_id)
+            self._execute(chat_id, batch)
+            with self._cond:
+                self._busy.discard(chat_id)
+                if self._queues.get(chat_id):
+                    self._ready[chat_id] = None
+                else:
+                    self._queues.pop(chat_id, None)
+                self._prune()
+                self._cond.notify_all()
+
+    def _execute(self, chat_id: int, batch: List['Job']) -> None:
+        job = batch[0]
+        method = getattr(job.func, '__name__', 'call')
+        try:
+            with telegram_seconds.time(method):
+                if len(batch) > 1:
+                    result = self._bot.send_message(chat_id, '\n\n'.join(item.text for item in batch))
+                    self._count('merged', len(batch) - 1)
+                else:
+                    result = job.func(*job.args, **job.kwargs)
+        except telebot.apihelper.ApiTelegramException as err:
+            telegram_calls.inc(method, err.error_code)
+            if err.error_code == 429 and job.attempts < self._max_attempts:
+                retry_after = err.result_json.get('parameters', {}).get('retry_after', 1)
+                logger.warning(f'Outbound: flood limit in chat {chat_id}, retry after {retry_after}s')
+                with self._cond:
+                    self._buckets[chat_id].block(retry_after)
+                    for item in reversed(batch):
+                        item.attempts += 1
+                        self._queues.setdefault(chat_id, deque()).appendleft(item)
+                    self.stats['retried'] += 1
+                return
+            self._fail(chat_id, batch, err)
+        except Exception as err:
+            telegram_calls.inc(method, 'error')
+            self._fail(chat_id, batch, err)
+        else:
+            telegram_calls.inc(method, 'ok')
+            self._count('sent')
+            for item in batch:
+                item.future.set_result(result)
+
+    def _fail(self, chat_id: int, batch: List['Job'], err: Exception) -> None:
+        logger.error(f'Outbound: chat {chat_id} - {err}')
+        self._count('failed')
+        for item in batch:
+            item.future.set_exception(err)
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._cond:
+            self.stats[name] += amount
+
+    def _prune(self) -> None:
+        if len(self._buckets) > 4096:
+            now = time.monotonic()
+            for chat_id in [chat_id for chat_id, bucket in self._buckets.items()
+                            if bucket.idle(now) and chat_id not in self._queues]:
+                del self._buckets[chat_id]
+
+
+def new_dispatcher(bot: 'telebot.TeleBot') -> 'OutboundDispatcher':
+    return OutboundDispatcher(bot, global_rate=float(getenv('outbound_global_rate', 30)),
+                              chat_rate=float(getenv('outbound_chat_rate', 1)),
+                              chat_burst=float(getenv('outbound_chat_burst', 3)),
+                              merge=getenv('outbound_merge', '1') == '1',
+                              workers=int(getenv('outbound_workers', 4)))
@@ -0,0 +1,52 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import List, Optional
+
+import requests
+import telebot
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+
+load_dotenv('.env')
+logger = logging.getLogger('main_logger')
+photo_workers = int(getenv('photo_workers', 8))
+executor = ThreadPoolExecutor(max_workers=photo_workers, thread_name_prefix='photos')
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_maxsize=photo_workers))
+
+
+def fetch_photo(url: str) -> Optional[bytes]:
+    try:
+        response = session.get(url, timeout=(3.05, 15))
+        response.raise_for_status()
+        return response.content
+    except requests.RequestException as err:
+        logger.warning(f'Photos.fetch_photo {url}: - {err}')
+        return None
+
+
+def fetch_photos(urls: List[str]) -> List[bytes]:
+    return [content for content in executor.map(fetch_photo, urls) if content]
+
+
+def send_album(bot: 'telebot.TeleBot', chat_id: int, urls: List[str], caption: str) -> None:
+    try:
+        _send(bot, chat_id, urls, caption)
+    except telebot.apihelper.ApiTelegramException as err:
+        if err.error_code == 429:
+            raise
+        logger.warning(f'Photos.send_album: Telegram rejected urls, uploading bytes - {err}')
+        contents = fetch_photos(urls)
+        if not contents:
+            raise
+        _send(bot, chat_id, contents, caption)
+
+
+def _send(bot: 'telebot.TeleBot', chat_id: int, media: List, caption: str) -> None:
+    if len(media) == 1:
+        bot.send_photo(chat_id, media[0], caption)
+    else:
+        bot.send_media_group(chat_id, [telebot.types.InputMediaPhoto(item, caption=caption if not i else None)
+                                       for i, item in enumerate(media)])
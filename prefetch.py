@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, TimeoutError
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+logger = logging.getLogger('search_logger')
+
+
+class PhotoPrefetcher:
+
+    def __init__(self, load: Callable[[str], List[str]], workers: int = 2, top_n: int = 3, max_items: int = 1000,
+                 ttl: int = 1800, enabled: Optional[Callable[[], bool]] = None,
+                 initializer: Optional[Callable[[], None]] = None) -> None:
+        self._load = load
+        self._enabled = enabled
+        self._top_n = top_n
+        self._max_items = max_items
+        self._ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch',
+                                            initializer=initializer)
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._chats = {}
+        self._lock = threading.Lock()
+        self.stats = {'loaded': 0, 'hits': 0, 'waited': 0, 'misses': 0, 'cancelled': 0, 'skipped': 0}
+
+    def prefetch(self, chat_id: int, hotel_ids: Iterable[str]) -> None:
+        if self._top_n <= 0:
+            return
+        self.cancel(chat_id)
+        if self._enabled is not None and not self._enabled():
+            self.stats['skipped'] += 1
+            return
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            submitted = []
+            for hotel_id in list(hotel_ids)[:self._top_n]:
+                if hotel_id in self._cache or hotel_id in self._pending:
+                    continue
+                self._pending[hotel_id] = self._executor.submit(self._fetch, hotel_id)
+                submitted.append(hotel_id)
+            if submitted:
+                self._chats[chat_id] = (now + self._ttl, submitted)
+
+    def get(self, hotel_id: str, timeout: float = 30) -> List[str]:
+        with self._lock:
+            if hotel_id in self._cache:
+                self._cache.move_to_end(hotel_id)
+                self.stats['hits'] += 1
+                return self._cache[hotel_id]
+            future = self._pending.get(hotel_id)
+        if future is not None:
+            try:
+                urls = future.result(timeout)
+                self.stats['waited'] += 1
+                return urls
+            except (CancelledError, TimeoutError):
+                pass
+            except Exception as err:
+                logger.warning(f'Prefetch.get {hotel_id}: prefetch failed, loading again - {err}')
+        self.stats['misses'] += 1
+        return self._fetch(hotel_id)
+
+    def cancel(self, chat_id: int) -> None:
+        with self._lock:
+            self._cancel(chat_id)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for chat_id in list(self._chats):
+                self._cancel(chat_id)
+        self._executor.shutdown(wait=False)
+
+    def _fetch(self, hotel_id: str) -> List[str]:
+        try:
+            urls = self._load(hotel_id)
+        finally:
+            with self._lock:
+                self._pending.pop(hotel_id, None)
+        with self._lock:
+            self._cache[hotel_id] = urls
+            self._cache.move_to_end(hotel_id)
+            while len(self._cache) > self._max_items:
+                self._cache.popitem(last=False)
+            self.stats['loaded'] += 1
+        return urls
+
+    def _cancel(self, chat_id: int) -> None:
+        _, hotel_ids = self._chats.pop(chat_id, (None, ()))
+        for hotel_id in hotel_ids:
+            future: Optional[Future] = self._pending.get(hotel_id)
+            if future is not None and future.cancel():
+                del self._pending[hotel_id]
+                self.stats['cancelled'] += 1
+
+    def _expire(self, now: float) -> None:
+        for chat_id in [chat_id for chat_id, (deadline, _) in self._chats.items() if deadline < now]:
+            self._cancel(chat_id)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return dict(self.stats, cached=len(self._cache), pending=len(self._pending))
@@ -0,0 +1,210 @@
+import atexit
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from os import getenv
+from typing import Dict, Iterator, Mapping, Optional
+
+from dotenv import load_dotenv
+from metrics import quota_requests
+
+
+load_dotenv('.env')
+logger = logging.getLogger('search_logger')
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+_priority = threading.local()
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def current_priority() -> str:
+    return getattr(_priority, 'value', INTERACTIVE)
+
+
+@contextmanager
+def priority(value: str) -> Iterator[None]:
+    previous = current_priority()
+    _priority.value = value
+    try:
+        yield
+    finally:
+        _priority.value = previous
+
+
+def mark_background() -> None:
+    _priority.value = BACKGROUND
+
+
+class QuotaManager:
+
+    def __init__(self, per_second: float = 5, per_day: int = 0, per_month: int = 0, degrade_at: float = 0.8,
+                 reserve: float = 0.5, max_wait: float = 2.0, page_size: int = 10, path: Optional[str] = None,
+                 save_interval: float = 5.0) -> None:
+        self._per_second = per_second
+        self._limits = {'day': per_day, 'month': per_month}
+        self._degrade_at = degrade_at
+        self._reserve = per_second * reserve
+        self._max_wait = max_wait
+        self._page_size = page_size
+        self._save_interval = save_interval
+        self._tokens = float(per_second)
+        self._refilled = time.monotonic()
+        self._used = {'day': 0, 'month': 0}
+        self._periods = self._current_periods()
+        self._remote = {}
+        self._dirty = False
+        self._saved = 0.0
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS quota (name TEXT PRIMARY KEY, period TEXT, used INTEGER)')
+            self._db.commit()
+            for name, period, used in self._db.execute('SELECT name, period, used FROM quota').fetchall():
+                if self._periods.get(name) == period:
+                    self._used[name] = used
+            atexit.register(self.close)
+
+    def acquire(self, endpoint: str = '') -> None:
+        level = current_priority()
+        deadline = time.monotonic() + (self._max_wait if level == INTERACTIVE else 0)
+        with self._lock:
+            self._roll()
+            reason = self._refuse(level)
+            while reason is None:
+                self._refill()
+                needed = 1 if level == INTERACTIVE else min(1 + self._reserve, max(1.0, self._per_second))
+                if self._per_second <= 0 or self._tokens >= needed:
+                    self._tokens -= 1
+                    for name in self._used:
+                        self._used[name] += 1
+                    self._dirty = True
+                    break
+                wait = (needed - self._tokens) / self._per_second
+                if time.monotonic() + wait > deadline:
+                    reason = 'rate'
+                    break
+                self._lock.release()
+                try:
+                    time.sleep(wait)
+                finally:
+                    self._lock.acquire()
+            save = self._dirty and time.monotonic() - self._saved >= self._save_interval
+        if reason is not None:
+            quota_requests.inc(level, reason)
+            raise QuotaExceeded(f'{endpoint}: {reason} quota exhausted for {level} requests')
+        quota_requests.inc(level, 'granted')
+        if save:
+            self.save()
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        remaining, limit = headers.get('x-ratelimit-requests-remaining'), headers.get('x-ratelimit-requests-limit')
+        if remaining is None or not remaining.isdigit():
+            return
+        reset = headers.get('x-ratelimit-requests-reset')
+        with self._lock:
+            self._remote = {'remaining': int(remaining)}
+            if limit and limit.isdigit():
+                self._remote['limit'] = int(limit)
+                self._used['month'] = max(self._used['month'], int(limit) - int(remaining))
+                self._dirty = True
+            if reset and reset.isdigit():
+                self._remote['reset'] = time.time() + int(reset)
+
+    def degraded(self) -> bool:
+        with self._lock:
+            self._roll()
+            return self._share() >= self._degrade_at
+
+    def page_size(self, requested: int) -> int:
+        return min(int(requested), self._page_size) if self.degraded() else int(requested)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            self._roll()
+            self._refill()
+            result = {'tokens': round(self._tokens, 3), 'share': round(self._share(), 4),
+                      'degraded': int(self._share() >= self._degrade_at)}
+            for name, used in self._used.items():
+                result[f'{name}_used'] = used
+                result[f'{name}_limit'] = self._limit(name)
+            if 'remaining' in self._remote:
+                result['remote_remaining'] = self._remote['remaining']
+            return result
+
+    def save(self) -> None:
+        with self._lock:
+            if self._db is None or not self._dirty:
+                return
+            rows = [(name, self._periods[name], used) for name, used in self._used.items()]
+            self._dirty = False
+            self._saved = time.monotonic()
+            try:
+                self._db.executemany('INSERT OR REPLACE INTO quota (name, period, used) VALUES (?, ?, ?)', rows)
+                self._db.commit()
+            except sqlite3.Error as err:
+                self._dirty = True
+                logger.warning(f'QuotaManager.save: - {err}')
+
+    def close(self) -> None:
+        self.save()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _refuse(self, level: str) -> Optional[str]:
+        for name in self._used:
+            limit = self._limit(name)
+            if limit and self._used[name] >= limit:
+                return name
+        if self._remote.get('remaining') == 0 and self._remote.get('reset', 0) > time.time():
+            return 'month'
+        if level != INTERACTIVE and self._share() >= self._degrade_at:
+            return 'reserved'
+        return None
+
+    def _limit(self, name: str) -> int:
+        if name == 'month' and self._remote.get('limit'):
+            return self._remote['limit']
+        return self._limits[name]
+
+    def _share(self) -> float:
+        shares = [self._used[name] / self._limit(name) for name in self._used if self._limit(name)]
+        return max(shares, default=0.0)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(float(self._per_second), self._tokens + (now - self._refilled) * self._per_second)
+        self._refilled = now
+
+    def _roll(self) -> None:
+        periods = self._current_periods()
+        reset = self._remote.get('reset')
+        if reset and reset <= time.time():
+            self._remote = {}
+            self._used['month'] = 0
+            self._dirty = True
+        for name, period in periods.items():
+            if self._periods[name] != period:
+                self._periods[name] = period
+                self._used[name] = 0
+                self._dirty = True
+
+    @staticmethod
+    def _current_periods() -> Dict[str, str]:
+        today = datetime.datetime.now(datetime.timezone.utc)
+        return {'day': today.strftime('%Y-%m-%d'), 'month': today.strftime('%Y-%m')}
+
+
+quota = QuotaManager(per_second=float(getenv('quota_per_second', 5)), per_day=int(getenv('quota_per_day', 0)),
+                     per_month=int(getenv('quota_per_month', 0)), degrade_at=float(getenv('quota_degrade_at', 0.8)),
+                     reserve=float(getenv('quota_interactive_reserve', 0.5)),
+                     max_wait=float(getenv('quota_max_wait', 2.0)), page_size=int(getenv('quota_page_size', 10)),
+                     path=getenv('quota_db', 'quota.db') or None)
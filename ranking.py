@@ -0,0 +1,65 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from searchresults import CityResult, HotelSet
+
+
+load_dotenv('.env')
+
+
+def normalize(values: Sequence[float]) -> List[float]:
+    finite = [value for value in values if value != float('inf')]
+    low = min(finite, default=0.0)
+    spread = (max(finite, default=0.0) - low) or 1.0
+    return [(value - low) / spread if value != float('inf') else 1.0 for value in values]
+
+
+class RankingEngine:
+
+    def __init__(self, price_weight: float = 0.5, distance_weight: float = 0.5, max_sets: int = 256,
+                 ttl: int = 600) -> None:
+        self._price_weight = price_weight
+        self._distance_weight = distance_weight
+        self._max_sets = max_sets
+        self._ttl = ttl
+        self._sets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(temp: 'CityResult') -> Tuple:
+        return (temp.id_location, temp.date_arrived, temp.date_leave, temp.currency,
+                tuple(str(value) for value in temp.range_prices))
+
+    def candidates(self, key: Tuple) -> Tuple['HotelSet', Optional[int]]:
+        with self._lock:
+            entry = self._sets.get(key)
+            if entry is None or entry[0] < time.time():
+                self._sets.pop(key, None)
+                return HotelSet(), 1
+            self._sets.move_to_end(key)
+            return HotelSet(entry[1]), entry[2]
+
+    def store(self, key: Tuple, hotels: 'HotelSet', next_page: Optional[int]) -> None:
+        with self._lock:
+            self._sets[key] = (time.time() + self._ttl, hotels, next_page)
+            self._sets.move_to_end(key)
+            while len(self._sets) > self._max_sets:
+                self._sets.popitem(last=False)
+
+    def rank(self, hotels: 'HotelSet', price_range: Sequence, distance_range: Sequence, k: int) -> 'HotelSet':
+        found = hotels.filter(price=(float(price_range[0]), float(price_range[1])),
+                              distance=(float(distance_range[0]), float(distance_range[1])))
+        prices, distances = normalize(found.column('price')), normalize(found.column('distance'))
+        scores = [self._price_weight * price + self._distance_weight * distance
+                  for price, distance in zip(prices, distances)]
+        return found.take(heapq.nsmallest(k, range(len(found)), key=scores.__getitem__))
+
+
+ranking = RankingEngine(price_weight=float(getenv('rank_price_weight', 0.5)),
+                        distance_weight=float(getenv('rank_distance_weight', 0.5)),
+                        ttl=int(getenv('rank_candidates_ttl', 600)))
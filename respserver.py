@@ -0,0 +1,206 @@
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class Keyspace:
+
+    def __init__(self, databases: int = 16) -> None:
+        self._databases = [{} for _ in range(databases)]
+        self._lock = threading.Lock()
+
+    def has_database(self, db: int) -> bool:
+        return 0 <= db < len(self._databases)
+
+    def run(self, db: int, command: str, args: List[bytes]) -> object:
+        handler = getattr(self, f'_{command}', None)
+        if handler is None:
+            return RuntimeError(f"ERR unknown command '{command}'")
+        with self._lock:
+            try:
+                return handler(self._databases[db], args)
+            except (IndexError, ValueError):
+                return RuntimeError(f"ERR wrong arguments for '{command}' command")
+
+    @staticmethod
+    def _live(data: Dict, key: bytes) -> Optional[bytes]:
+        item = data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= time.time():
+            del data[key]
+            return None
+        return item[0]
+
+    def _get(self, data: Dict, args: List[bytes]) -> Optional[bytes]:
+        return self._live(data, args[0])
+
+    def _set(self, data: Dict, args: List[bytes]) -> Optional[str]:
+        key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+        expires = None
+        if b'EX' in options:
+            expires = time.time() + int(args[2 + options.index(b'EX') + 1])
+        if b'PX' in options:
+            expires = time.time() + int(args[2 + options.index(b'PX') + 1]) / 1000
+        if b'NX' in options and self._live(data, key) is not None:
+            return None
+        data[key] = (value, expires)
+        return 'OK'
+
+    def _getdel(self, data: Dict, args: List[bytes]) -> Optional[bytes]:
+        value = self._live(data, args[0])
+        data.pop(args[0], None)
+        return value
+
+    def _mget(self, data: Dict, args: List[bytes]) -> List[Optional[bytes]]:
+        return [self._live(data, key) for key in args]
+
+    def _del(self, data: Dict, args: List[bytes]) -> int:
+        return sum(self._live(data, key) is not None and data.pop(key) is not None for key in args)
+
+    def _exists(self, data: Dict, args: List[bytes]) -> int:
+        return sum(self._live(data, key) is not None for key in args)
+
+    def _expire(self, data: Dict, args: List[bytes]) -> int:
+        value = self._live(data, args[0])
+        if value is None:
+            return 0
+        data[args[0]] = (value, time.time() + int(args[1]))
+        return 1
+
+    def _ttl(self, data: Dict, args: List[bytes]) -> int:
+        if self._live(data, args[0]) is None:
+            return -2
+        expires = data[args[0]][1]
+        return -1 if expires is None else max(0, int(expires - time.time()))
+
+    def _keys(self, data: Dict, args: List[bytes]) -> List[bytes]:
+        pattern = args[0].decode()
+        return [key for key in list(data) if self._live(data, key) is not None
+                and fnmatch.fnmatchcase(key.decode(), pattern)]
+
+    def _scan(self, data: Dict, args: List[bytes]) -> List[object]:
+        cursor, options = int(args[0]), [arg.upper() for arg in args[1:]]
+        pattern = args[1 + options.index(b'MATCH') + 1].decode() if b'MATCH' in options else '*'
+        count = int(args[1 + options.index(b'COUNT') + 1]) if b'COUNT' in options else 10
+        keys = sorted(data)[cursor:cursor + count]
+        following = cursor + count if cursor + count < len(data) else 0
+        return [str(following).encode(), [key for key in keys if self._live(data, key) is not None
+                                           and fnmatch.fnmatchcase(key.decode(), pattern)]]
+
+    def _dbsize(self, data: Dict, args: List[bytes]) -> int:
+        return len(data)
+
+    def _flushdb(self, data: Dict, args: List[bytes]) -> str:
+        data.clear()
+        return 'OK'
+
+    def _ping(self, data: Dict, args: List[bytes]) -> object:
+        return args[0] if args else 'PONG'
+
+    def _echo(self, data: Dict, args: List[bytes]) -> bytes:
+        return args[0]
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+
+    server: 'RespServer'
+
+    def handle(self) -> None:
+        db = 0
+        while True:
+            try:
+                args = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            if not args:
+                continue
+            command = args[0].decode().lower()
+            if command == 'quit':
+                self._write('OK')
+                return
+            if command == 'select':
+                if self.server.keyspace.has_database(int(args[1])):
+                    db, reply = int(args[1]), 'OK'
+                else:
+                    reply = RuntimeError('ERR DB index is out of range')
+            elif command == 'auth':
+                reply = 'OK'
+            else:
+                reply = self.server.keyspace.run(db, command, args[1:])
+            self._write(reply)
+
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def _write(self, reply: object) -> None:
+        self.wfile.write(b''.join(self._encode(reply)))
+
+    def _encode(self, reply: object) -> List[bytes]:
+        if reply is None:
+            return [b'$-1\r\n']
+        if isinstance(reply, RuntimeError):
+            return [f'-{reply}\r\n'.encode()]
+        if isinstance(reply, str):
+            return [f'+{reply}\r\n'.encode()]
+        if isinstance(reply, int):
+            return [f':{reply}\r\n'.encode()]
+        if isinstance(reply, bytes):
+            return [b'$%d\r\n%s\r\n' % (len(reply), reply)]
+        parts = [f'*{len(reply)}\r\n'.encode()]
+        for item in reply:
+            parts.extend(self._encode(item))
+        return parts
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int], keyspace: Optional['Keyspace'] = None) -> None:
+        self.keyspace = keyspace or Keyspace()
+        super().__init__(address, RespHandler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'redis://{host}:{port}/0'
+
+    def start(self) -> 'RespServer':
+        threading.Thread(target=self.serve_forever, name='resp-server', daemon=True).start()
+        return self
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='In-memory stand-in for a Redis server (GET, SET, GETDEL, MGET, '
+                                                 'DEL, EXPIRE, TTL, KEYS, SCAN) for local multi-process runs.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    server = RespServer((args.host, args.port))
+    print(f'Serving {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
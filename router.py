@@ -0,0 +1,112 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import telebot
+
+
+logger = logging.getLogger('main_logger')
+
+VERSION = '1'
+SEP = ':'
+STORED = '~'
+MAX_PAYLOAD = 64
+
+
+class PayloadStore:
+
+    def __init__(self, max_items: int = 10000, ttl: int = 24 * 3600) -> None:
+        self._max_items = max_items
+        self._ttl = ttl
+        self._items = OrderedDict()
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def put(self, args: Tuple[str, ...]) -> str:
+        with self._lock:
+            token = format(next(self._counter), 'x')
+            self._items[token] = (time.time() + self._ttl, args)
+            while len(self._items) > self._max_items:
+                self._items.popitem(last=False)
+            return token
+
+    def get(self, token: str) -> Optional[Tuple[str, ...]]:
+        with self._lock:
+            item = self._items.get(token)
+        if item is None or item[0] < time.time():
+            return None
+        return item[1]
+
+
+class CallbackRouter:
+
+    def __init__(self, bot: 'telebot.TeleBot', store: Optional['PayloadStore'] = None) -> None:
+        self._bot = bot
+        self._routes = {}
+        self._store = store or PayloadStore()
+        self._lock = threading.Lock()
+        self.stats = {}
+        bot.callback_query_handler(func=lambda call: True)(self.dispatch)
+
+    def route(self, tag: str) -> Callable:
+        def decorator(func: Callable) -> Callable:
+            self._routes[VERSION + tag] = (func, True)
+            self.stats[tag] = {'calls': 0, 'errors': 0, 'seconds': 0.0}
+            return func
+        return decorator
+
+    def raw(self, prefix: str) -> Callable:
+        def decorator(func: Callable) -> Callable:
+            self._routes[prefix] = (func, False)
+            self.stats[prefix] = {'calls': 0, 'errors': 0, 'seconds': 0.0}
+            return func
+        return decorator
+
+    def encode(self, tag: str, *args) -> str:
+        args = tuple(str(arg) for arg in args)
+        payload = SEP.join((VERSION + tag,) + args)
+        if len(payload.encode()) > MAX_PAYLOAD or any(SEP in arg or arg.startswith(STORED) for arg in args):
+            payload = f'{VERSION}{tag}{SEP}{STORED}{self._store.put(args)}'
+        return payload
+
+    def decode(self, data: str) -> Tuple[Optional[str], Optional[Callable], Tuple[str, ...]]:
+        head, _, tail = data.partition(SEP)
+        route = self._routes.get(head)
+        if route is None:
+            return None, None, ()
+        func, encoded = route
+        tag = head[len(VERSION):] if encoded else head
+        if not encoded:
+            return tag, func, ()
+        if tail.startswith(STORED):
+            args = self._store.get(tail[len(STORED):])
+            return (tag, func, args) if args is not None else (tag, None, ())
+        return tag, func, tuple(tail.split(SEP)) if tail else ()
+
+    def dispatch(self, call: 'telebot.types.CallbackQuery') -> None:
+        tag, func, args = self.decode(call.data or '')
+        if func is None:
+            self._count(tag or 'unknown', 'errors')
+            self._bot.answer_callback_query(call.id, 'Эта кнопка устарела. Введите /help для вывода доступных команд.')
+            return
+        start = time.perf_counter()
+        try:
+            func(call, *args)
+        except Exception as err:
+            self._count(tag, 'errors')
+            logger.error(f'Router {tag}: {call.data} - {err}')
+        finally:
+            self._count(tag, 'seconds', time.perf_counter() - start)
+            self._count(tag, 'calls')
+
+    def _count(self, tag: str, name: str, value: float = 1) -> None:
+        with self._lock:
+            counters = self.stats.setdefault(tag, {'calls': 0, 'errors': 0, 'seconds': 0.0})
+            counters[name] += value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {tag: dict(counters) for tag, counters in self.stats.items()}
@@ -1,137 +1,203 @@
-import logging
-import os
 import re
-import requests
-from langdetect import detect
-from typing import Union, List
-from searchresults import Hotel, CityResult
-from dotenv import load_dotenv
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Union, List, Dict, Iterator, Optional, Tuple
+from searchresults import LOCALE, Hotel, CityResult, HotelSet
+from apiclient import client
+from cache import response_cache
+from localeresolver import resolve_locale
+from ranking import ranking
+from prefetch import PhotoPrefetcher
+from destinations import ACCEPTABLE, build_index
+from logpipeline import new_logger
+from listparser import parse_property_list
+from quota import QuotaExceeded, mark_background, quota
 from os import getenv
 
 
-def new_logger(name: str, level=logging.ERROR, file: str = 'logs.log') -> logging:
-    log = logging.getLogger(name)
-    if log.hasHandlers():
-        log.handlers = []
-    log.setLevel(level)
-    handler = logging.FileHandler(file, encoding='utf8')
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    log.addHandler(handler)
-    return log
-
-
-load_dotenv('.env')
-api = getenv("hotelAPIkey")
 logger = new_logger('search_logger')
-headers = {
-    'x-rapidapi-key': api,
-    'x-rapidapi-host': "hotels4.p.rapidapi.com"}
+max_pages = int(getenv('max_pages', 5))
+pager = ThreadPoolExecutor(max_workers=int(getenv('pager_workers', 4)), thread_name_prefix='pager')
+destinations = build_index(getenv('destinations_db', 'destinations.db'), getenv('destinations_seed'),
+                           response_cache.values('/locations/search'))
 
 
 class Search:
 
     @classmethod
-    def search_town(cls, town: str) -> Union[List, str]:
-        cls.url = "https://hotels4.p.rapidapi.com/locations/search"
-        cls.querystring = {"query": town,
-                           "locale": '_'.join([detect(town).lower(), detect(town).upper()])
-                           }
+    def _request(cls, url: str, querystring: Dict, parse: Callable[[Any], Dict] = None) -> Dict:
+        def load() -> Dict:
+            if parse is None:
+                response = client.get(url, querystring)
+                response.raise_for_status()
+                return response.json()
+            with client.get(url, querystring, stream=True) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                return parse(response.raw)
+
         try:
-            cls.response = requests.request("GET", cls.url, headers=headers, params=cls.querystring)
-            results = cls.response.json()['suggestions'][0]['entities']
-            town_list = []
-            for item in results:
-                if item['type'] == 'CITY' and item['name'].lower() == town.lower():
-                    result = re.findall(r'<span.+>(.+)<.span>, (.+)"', str(item))
-                    result.append(item['destinationId'])
-                    town_list.append(result)
-            return town_list
-        except BaseException as err:
-            logger.critical(f'Searchrequests.search_town: - {err}')
-            return 'error'
+            return response_cache.get_or_load(url, querystring, load, stale_ok=quota.degraded())
+        except QuotaExceeded:
+            found, value = response_cache.stale(url, querystring)
+            if not found:
+                raise
+            return value
+
+    @classmethod
+    def search_town(cls, town: str) -> Union[List[Tuple[str, str, str]], str]:
+        found = destinations.match(town)
+        if not found:
+            url = '/locations/search'
+            querystring = {"query": town, "locale": resolve_locale(town)}
+            try:
+                cities = destinations.add_response(cls._request(url, querystring))
+                found = destinations.match(town, ACCEPTABLE, among=cities)
+                destinations.confirm(town, found)
+            except QuotaExceeded as err:
+                logger.warning(f'Searchrequests.search_town: - {err}')
+                return 'quota'
+            except BaseException as err:
+                logger.critical(f'Searchrequests.search_town: - {err}')
+                return 'error'
+        return [(item.name, item.region, item.destination_id) for item in found]
 
     @classmethod
     def search_hotels(cls, temp: 'CityResult') -> Union['CityResult', str]:
-        cls.url = "https://hotels4.p.rapidapi.com/properties/list"
-        cls.querystring = {"adults1": "1", "pageNumber": "1", "destinationId": temp.id_location,
-                           "pageSize": temp.num_result, "checkOut": temp.date_leave,
-                           "checkIn": temp.date_arrived, "sortOrder": temp.mode_search,
-                           "locale": "ru_RU", "currency": temp.currency}
-        try:
-            cls.response = requests.request("GET", cls.url, headers=headers, params=cls.querystring)
-            results = cls.response.json()["data"]["body"]["searchResults"]["results"]
-            for item in results:
-                if item['address'].get('streetAddress') is None:
-                    address = 'Не указан'
-                else:
-                    address = item['address']['streetAddress'] + item['address']['extendedAddress']
-                temp.all_hotels = Hotel(item['name'], address,
-                                        item["ratePlan"]["price"]["current"],
-                                        item['landmarks'][0]['distance'],
-                                        item['id'])
-        except BaseException as err:
-            logger.critical(f'Searchrequests.search_hotels: - {err}')
+        for _ in cls.iter_hotels(temp):
+            pass
         return temp
 
     @classmethod
     def best_deal(cls, temp: 'CityResult', distance_range: List) -> Union['CityResult', str]:
-        cls.url = "https://hotels4.p.rapidapi.com/properties/list"
-        cls.querystring = {"adults1": "1", "pageNumber": "1", "destinationId": temp.id_location,
-                           "pageSize": temp.num_result, "checkOut": temp.date_leave,
-                           "checkIn": temp.date_arrived, "sortOrder": "PRICE",
-                           "locale": "ru_RU", "currency": temp.currency, "priceMin": temp.range_prices[0],
-                           "priceMax": temp.range_prices[1]}
         try:
-            cls.response = requests.request("GET", cls.url, headers=headers, params=cls.querystring)
-            results = cls.response.json()["data"]["body"]["searchResults"]["results"]
-            for item in results:
-                if int(float(item['landmarks'][0]['distance'][:-3].replace(',', '.')) * 10) in range(
-                        int(float(distance_range[0]) * 10), int(float(distance_range[1]) * 10)):
-                    if item['address'].get('streetAddress') is None:
-                        address = 'Не указан'
-                    else:
-                        address = item['address']['streetAddress'] + item['address']['extendedAddress']
-                    temp.all_hotels = Hotel(item['name'], address,
-                                            item["ratePlan"]["price"]["current"],
-                                            item['landmarks'][0]['distance'],
-                                            item['id'])
-        except BaseException as err:
+            found = ranking.rank(cls.candidates(temp, distance_range), temp.range_prices, distance_range,
+                                 int(temp.num_result))
+        except QuotaExceeded:
+            raise
+        except Exception as err:
             logger.critical(f'Searchrequests.best_deal: - {err}')
+            found = ()
+        for hotel in found:
+            temp.all_hotels = hotel
         return temp
 
+    @classmethod
+    def candidates(cls, temp: 'CityResult', distance_range: List) -> 'HotelSet':
+        key = ranking.key(temp)
+        hotels, next_page = ranking.candidates(key)
+        limit, distance = int(temp.num_result), (float(distance_range[0]), float(distance_range[1]))
+        if next_page and len(hotels.filter(distance=distance)) < limit:
+            querystring = dict(cls._list_query(temp), pageSize=str(quota.page_size(25)), sortOrder="PRICE",
+                               priceMin=temp.range_prices[0], priceMax=temp.range_prices[1])
+            matches = len(hotels.filter(distance=distance))
+            for page_hotels, next_page in cls._iter_pages(querystring, next_page, prefetch=True):
+                for hotel in page_hotels:
+                    hotels.append(hotel)
+                    matches += distance[0] <= hotel.distance_value <= distance[1]
+                if matches >= limit:
+                    break
+            ranking.store(key, hotels, next_page)
+        return hotels
+
+    @classmethod
+    def iter_hotels(cls, temp: 'CityResult', distance_range: List = None) -> Iterator['Hotel']:
+        if distance_range is not None:
+            yield from cls.best_deal(temp, distance_range).all_hotels
+            return
+        limit = int(temp.num_result)
+        try:
+            for hotels, _ in cls._iter_pages(cls._list_query(temp)):
+                for hotel in hotels:
+                    temp.all_hotels = hotel
+                    yield hotel
+                    if len(temp.all_hotels) >= limit:
+                        return
+        except QuotaExceeded as err:
+            logger.warning(f'Searchrequests.iter_hotels: - {err}')
+            raise
+        except Exception as err:
+            logger.critical(f'Searchrequests.iter_hotels: - {err}')
+
+    @classmethod
+    def _list_query(cls, temp: 'CityResult') -> Dict:
+        return {"adults1": "1", "pageNumber": "1", "destinationId": temp.id_location,
+                "pageSize": str(quota.page_size(temp.num_result)), "checkOut": temp.date_leave,
+                "checkIn": temp.date_arrived, "sortOrder": temp.mode_search,
+                "locale": LOCALE, "currency": temp.currency}
+
+    @classmethod
+    def _iter_pages(cls, querystring: Dict, page: int = 1,
+                    prefetch: bool = False) -> Iterator[Tuple[List['Hotel'], Optional[int]]]:
+        def fetch(number: int) -> Future:
+            return pager.submit(cls._request, '/properties/list', dict(querystring, pageNumber=str(number)),
+                                parse_property_list)
+
+        future = fetch(page)
+        try:
+            while future is not None:
+                body = future.result()["data"]["body"]["searchResults"]
+                page += 1
+                future = None
+                has_next = bool(body.get('pagination', {}).get('nextPageNumber')) and \
+                    page <= (1 if quota.degraded() else max_pages)
+                if has_next and prefetch:
+                    future = fetch(page)
+                yield [cls._make_hotel(item) for item in body["results"]], page if has_next else None
+                if has_next and future is None:
+                    future = fetch(page)
+        finally:
+            if future is not None:
+                future.cancel()
+
+    @classmethod
+    def _make_hotel(cls, item: Dict) -> 'Hotel':
+        street = (item.get('address') or {}).get('streetAddress')
+        if street is None:
+            address = 'Не указан'
+        else:
+            address = street + (item['address'].get('extendedAddress') or '')
+        price = (item.get('ratePlan') or {}).get('price') or {}
+        landmarks = item.get('landmarks') or [{}]
+        return Hotel(item.get('name'), address,
+                     price.get('current', 'не указана'),
+                     landmarks[0].get('distance', 'не указано'),
+                     item.get('id'),
+                     price.get('exactCurrent'))
+
     @classmethod
     def show_photos(cls, hotel: 'Hotel', number: int) -> 'Hotel':
-        cls.url = "https://hotels4.p.rapidapi.com/properties/get-hotel-photos"
-        cls.querystring = {"id": hotel.hotel_id}
         try:
-            cls.response = requests.request("GET", cls.url, headers=headers, params=cls.querystring)
-            results = cls.response.json()["hotelImages"]
-            for i in range(number):
-                hotel.url_photo.append(results[i]['baseUrl'].replace('{size}', results[i]['sizes'][0]['suffix']))
+            urls = photo_prefetcher.get(hotel.hotel_id)
+            hotel.url_photo.clear()
+            hotel.url_photo.extend(urls[:number])
         except BaseException as err:
             logger.critical(f'Searchrequests.show_photo: - {err}')
         return hotel
 
+    @classmethod
+    def photo_urls(cls, hotel_id: str) -> List[str]:
+        url = '/properties/get-hotel-photos'
+        querystring = {"id": hotel_id}
+        results = cls._request(url, querystring)["hotelImages"]
+        return [item['baseUrl'].replace('{size}', item['sizes'][0]['suffix']) for item in results]
+
     @classmethod
     def set_limits(cls, string: str) -> List:
         temp = []
         string = tuple(string.split())
         for item in string:
-            if item.isdigit():
-                temp.append(item)
+            if re.fullmatch(r'\d+([.,]\d+)?', item):
+                temp.append(item.replace(',', '.'))
         if len(temp) != 2:
             temp = []
         else:
-            if int(temp[0]) > int(temp[1]):
+            if float(temp[0]) > float(temp[1]):
                 temp[0], temp[1] = temp[1], temp[0]
         return temp
 
-    @classmethod
-    def history(cls, filename: str, text: str) -> None:
-        if not os.path.exists('history'):
-            os.mkdir("history")
-        path = os.path.abspath(os.path.join('history', filename))
-        mode = 'a' if os.path.exists(path) else 'w'
-        with open(path, mode, encoding='utf-8') as history:
-            history.write(text)
+
+photo_prefetcher = PhotoPrefetcher(Search.photo_urls, workers=int(getenv('prefetch_workers', 2)),
+                                   top_n=int(getenv('prefetch_photos', 3)),
+                                   max_items=int(getenv('photo_cache_size', 1000)),
+                                   ttl=int(getenv('session_ttl', 1800)),
+                                   enabled=lambda: not quota.degraded(), initializer=mark_background)
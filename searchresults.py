@@ -1,9 +1,47 @@
 import datetime
-from typing import List
+import heapq
+import re
+from array import array
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
+
+_number = re.compile(r'\d[\d\s\u00a0\u202f.,]*')
+MILE = 1.609344
+LOCALE = 'ru_RU'
+DECIMAL = {'ru_RU': ',', 'en_US': '.'}
+
+
+def parse_number(text: str, locale: str = LOCALE) -> Optional[float]:
+    match = _number.search(text or '')
+    if match is None:
+        return None
+    number = re.sub(r'[\s\u00a0\u202f]', '', match.group()).rstrip('.,')
+    decimal = DECIMAL.get(locale, '.')
+    thousands = '.' if decimal == ',' else ','
+    if decimal in number:
+        whole, _, fraction = number.rpartition(decimal)
+        number = re.sub(r'[.,]', '', whole) + '.' + fraction
+    elif decimal == '.' or number.count(thousands) > 1:
+        number = number.replace(thousands, '')
+    return float(number)
+
+
+def parse_price(text: str, locale: str = LOCALE) -> Tuple[float, str]:
+    value = parse_number(text, locale)
+    currency = _number.sub('', text or '').strip()
+    return (float('inf') if value is None else value), currency
+
+
+def parse_distance(text: str, locale: str = LOCALE) -> float:
+    value = parse_number(text, locale)
+    if value is None:
+        return float('inf')
+    return value * MILE if 'mile' in (text or '').lower() or 'мил' in (text or '').lower() else value
 
 
 class CityResult:
 
+    __slots__ = ('_town', '_id_location', '_num_result', '_mode_search', '_hotels', '_range_prices', '_currency',
+                 '_date_arrived', '_date_leave', '_history_id')
     _mode = {'/bestdeal': 'DISTANCE_FROM_LANDMARK', '/lowprice': 'PRICE', '/highprice': 'PRICE_HIGHEST_FIRST'}
 
     def __init__(self, town: str = None, id_location: str = None, num_result: str = '25',
@@ -12,11 +50,12 @@ class CityResult:
         self._id_location = id_location
         self._num_result = num_result
         self._mode_search = CityResult._mode[mode]
-        self._hotels = []
+        self._hotels = HotelSet()
         self._range_prices = []
         self._currency = currency
         self._date_arrived = None
         self._date_leave = None
+        self._history_id = None
 
     @property
     def id_location(self) -> str:
@@ -51,7 +90,7 @@ class CityResult:
         self._num_result = value
 
     @property
-    def all_hotels(self) -> List:
+    def all_hotels(self) -> 'HotelSet':
         return self._hotels
 
     @all_hotels.setter
@@ -90,6 +129,14 @@ class CityResult:
     def date_leave(self, value: datetime.datetime) -> None:
         self._date_leave = value
 
+    @property
+    def history_id(self) -> int:
+        return self._history_id
+
+    @history_id.setter
+    def history_id(self, value: int) -> None:
+        self._history_id = value
+
     def clear_hotel_list(self):
         self._town = None
         self._id_location = None
@@ -100,18 +147,44 @@ class CityResult:
         self._currency = 'USD'
         self._date_arrived = None
         self._date_leave = None
+        self._history_id = None
+
+    def to_dict(self) -> Dict:
+        return {'town': self._town, 'id_location': self._id_location, 'num_result': self._num_result,
+                'mode_search': self._mode_search, 'hotels': [hotel.to_dict() for hotel in self._hotels],
+                'range_prices': list(self._range_prices), 'currency': self._currency,
+                'date_arrived': self._date_arrived, 'date_leave': self._date_leave, 'history_id': self._history_id}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'CityResult':
+        result = cls(data['town'], data['id_location'], data['num_result'], currency=data['currency'])
+        result._mode_search = data['mode_search']
+        result._hotels = HotelSet(Hotel.from_dict(hotel) for hotel in data['hotels'])
+        result._range_prices = list(data['range_prices'])
+        result._date_arrived = data['date_arrived']
+        result._date_leave = data['date_leave']
+        result._history_id = data.get('history_id')
+        return result
 
 
 class Hotel:
 
+    __slots__ = ('_title_hotel', '_hotel_id', '_address_hotel', '_price_summary', '_distance_from_center',
+                 '_url_photo', '_price_value', '_currency', '_distance_value')
+
     def __init__(self, title_hotel: str = None, address_hotel: str = None,
-                 price_summary: str = None, distance_from_center: str = None, hotel_id: str = None) -> None:
+                 price_summary: str = None, distance_from_center: str = None, hotel_id: str = None,
+                 price_value: float = None, distance_value: float = None) -> None:
         self._title_hotel = title_hotel
         self._hotel_id = hotel_id
         self._address_hotel = address_hotel
         self._price_summary = price_summary
         self._distance_from_center = distance_from_center
         self._url_photo = []
+        parsed_price, self._currency = parse_price(price_summary)
+        self._price_value = float(price_value) if price_value is not None else parsed_price
+        self._distance_value = float(distance_value) if distance_value is not None \
+            else parse_distance(distance_from_center)
 
     @property
     def name(self) -> str:
@@ -136,6 +209,15 @@ class Hotel:
     @price.setter
     def price(self, value: str) -> None:
         self._price_summary = value
+        self._price_value, self._currency = parse_price(value)
+
+    @property
+    def price_value(self) -> float:
+        return self._price_value
+
+    @property
+    def currency(self) -> str:
+        return self._currency
 
     @property
     def distance(self) -> str:
@@ -144,6 +226,11 @@ class Hotel:
     @distance.setter
     def distance(self, value: str) -> None:
         self._distance_from_center = value
+        self._distance_value = parse_distance(value)
+
+    @property
+    def distance_value(self) -> float:
+        return self._distance_value
 
     @property
     def hotel_id(self) -> str:
@@ -161,9 +248,76 @@ class Hotel:
     def url_photo(self, value: str) -> None:
         self._url_photo.append(value)
 
+    def to_dict(self) -> Dict:
+        return {'name': self._title_hotel, 'address': self._address_hotel, 'price': self._price_summary,
+                'distance': self._distance_from_center, 'hotel_id': self._hotel_id, 'url_photo': self._url_photo,
+                'price_value': self._price_value, 'distance_value': self._distance_value}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Hotel':
+        hotel = cls(data['name'], data['address'], data['price'], data['distance'], data['hotel_id'],
+                    data.get('price_value'), data.get('distance_value'))
+        hotel._url_photo = list(data['url_photo'])
+        return hotel
+
     def __str__(self) -> str:
         return f'{self._title_hotel} находится по адресу: {self._address_hotel}, на расстоянии ' \
                f'от центра {self._distance_from_center}. Общая стоимость: {self._price_summary}'
 
 
-city = CityResult()
+class HotelSet:
+
+    __slots__ = ('_hotels', '_prices', '_distances')
+    _columns = {'price': '_prices', 'distance': '_distances'}
+
+    def __init__(self, hotels: Iterable['Hotel'] = ()) -> None:
+        self._hotels = []
+        self._prices = array('d')
+        self._distances = array('d')
+        for hotel in hotels:
+            self.append(hotel)
+
+    def append(self, hotel: 'Hotel') -> None:
+        self._hotels.append(hotel)
+        self._prices.append(hotel.price_value)
+        self._distances.append(hotel.distance_value)
+
+    def clear(self) -> None:
+        self._hotels.clear()
+        del self._prices[:]
+        del self._distances[:]
+
+    def column(self, name: str) -> 'array':
+        return getattr(self, self._columns[name])
+
+    def filter(self, price: Tuple[float, float] = None, distance: Tuple[float, float] = None) -> 'HotelSet':
+        prices, distances = self._prices, self._distances
+        return self.take(i for i in range(len(self._hotels))
+                          if (price is None or price[0] <= prices[i] <= price[1])
+                          and (distance is None or distance[0] <= distances[i] <= distance[1]))
+
+    def sorted(self, key: str = 'price', reverse: bool = False) -> 'HotelSet':
+        values = self.column(key)
+        return self.take(sorted(range(len(self._hotels)), key=values.__getitem__, reverse=reverse))
+
+    def top_k(self, k: int, key: str = 'price', reverse: bool = False) -> 'HotelSet':
+        values = self.column(key)
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        return self.take(select(k, range(len(self._hotels)), key=values.__getitem__))
+
+    def take(self, indexes: Iterable[int]) -> 'HotelSet':
+        result = HotelSet()
+        for i in indexes:
+            result._hotels.append(self._hotels[i])
+            result._prices.append(self._prices[i])
+            result._distances.append(self._distances[i])
+        return result
+
+    def __len__(self) -> int:
+        return len(self._hotels)
+
+    def __iter__(self) -> Iterator['Hotel']:
+        return iter(self._hotels)
+
+    def __getitem__(self, index: int) -> 'Hotel':
+        return self._hotels[index]
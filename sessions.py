@@ -0,0 +1,135 @@
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Callable, Optional, Tuple
+
+from dotenv import load_dotenv
+from searchresults import CityResult
+from searchrequests import new_logger
+from sharedstate import state
+
+
+load_dotenv('.env')
+logger = new_logger('sessions_logger', logging.WARNING)
+
+
+class SessionStore:
+
+    def __init__(self, ttl: int = 1800, max_sessions: int = 1000, state=None, flush_interval: int = 5,
+                 prefix: str = 'session:') -> None:
+        self._ttl = ttl
+        self._max_sessions = max_sessions
+        self._flush_interval = flush_interval
+        self._sessions = OrderedDict()
+        self._dirty = set()
+        self._lock = threading.RLock()
+        self._state = state
+        self._prefix = prefix
+        self.on_evict: Optional[Callable[[int], None]] = None
+        if state is not None:
+            self._start_flusher()
+            atexit.register(self.close)
+
+    def get(self, chat_id: int) -> 'CityResult':
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            if chat_id in self._sessions:
+                session = self._sessions.pop(chat_id)[0]
+            else:
+                session = self._load(chat_id, now) or CityResult()
+            self._sessions[chat_id] = (session, now)
+            self._dirty.add(chat_id)
+            while len(self._sessions) > self._max_sessions:
+                old_id, (old_session, last_access) = self._sessions.popitem(last=False)
+                self._store(old_id, old_session, last_access)
+                self._dirty.discard(old_id)
+                self._evicted(old_id)
+            return session
+
+    def drop(self, chat_id: int) -> None:
+        with self._lock:
+            self._sessions.pop(chat_id, None)
+            self._dirty.discard(chat_id)
+            self._evicted(chat_id)
+            if self._state:
+                self._state.delete(f'{self._prefix}{chat_id}')
+
+    def flush(self) -> None:
+        with self._lock:
+            records = [(chat_id, self._record(*self._sessions[chat_id])) for chat_id in self._dirty
+                       if chat_id in self._sessions]
+            self._dirty.clear()
+        for chat_id, (payload, ttl) in records:
+            if self._state and ttl > 0:
+                self._state.set(f'{self._prefix}{chat_id}', payload, ttl)
+
+    def close(self) -> None:
+        if self._state:
+            self.flush()
+            self._state = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict_expired(self, now: float) -> None:
+        while self._sessions:
+            chat_id, (session, last_access) = next(iter(self._sessions.items()))
+            if now - last_access < self._ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._dirty.discard(chat_id)
+            self._evicted(chat_id)
+
+    def _evicted(self, chat_id: int) -> None:
+        if self.on_evict is not None:
+            try:
+                self.on_evict(chat_id)
+            except Exception as err:
+                logger.error(f'Sessions.on_evict: chat {chat_id} - {err}')
+
+    def _load(self, chat_id: int, now: float) -> Optional['CityResult']:
+        if not self._state:
+            return None
+        raw = self._state.get(f'{self._prefix}{chat_id}')
+        if raw is None:
+            return None
+        try:
+            record = json.loads(raw)
+            if now - record['last_access'] >= self._ttl:
+                return None
+            return CityResult.from_dict(record['data'])
+        except (ValueError, KeyError) as err:
+            logger.error(f'Sessions._load: chat {chat_id} - {err}')
+            return None
+
+    def _record(self, session: 'CityResult', last_access: float) -> Tuple[str, float]:
+        return (json.dumps({'last_access': last_access, 'data': session.to_dict()}, ensure_ascii=False),
+                last_access + self._ttl - time.time())
+
+    def _store(self, chat_id: int, session: 'CityResult', last_access: float) -> None:
+        if not self._state:
+            return
+        payload, ttl = self._record(session, last_access)
+        if ttl > 0:
+            self._state.set(f'{self._prefix}{chat_id}', payload, ttl)
+
+    def _start_flusher(self) -> None:
+        def run() -> None:
+            while self._state:
+                time.sleep(self._flush_interval)
+                try:
+                    self.flush()
+                except Exception as err:
+                    logger.error(f'Sessions.flush: - {err}')
+
+        threading.Thread(target=run, name='sessions-flusher', daemon=True).start()
+
+
+sessions = SessionStore(ttl=int(getenv('session_ttl', 1800)),
+                        max_sessions=int(getenv('max_sessions', 1000)),
+                        state=state if state.persistent else None)
@@ -0,0 +1,250 @@
+import socket
+import sqlite3
+import threading
+import time
+from os import getenv
+from typing import List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from dotenv import load_dotenv
+
+
+load_dotenv('.env')
+
+
+class MemoryState:
+
+    persistent = False
+
+    def __init__(self, sweep_every: int = 1000) -> None:
+        self._data = {}
+        self._sweep_every = sweep_every
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(key, time.time())
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._data[key] = (value, now + ttl if ttl else None)
+            self._writes += 1
+            if self._writes % self._sweep_every == 0:
+                for old in [old for old, item in self._data.items() if item[1] is not None and item[1] <= now]:
+                    del self._data[old]
+
+    def pop(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._live(key, time.time())
+            self._data.pop(key, None)
+            return value
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def items(self, prefix: str) -> List[Tuple[str, str]]:
+        now = time.time()
+        with self._lock:
+            return [(key, item[0]) for key, item in self._data.items()
+                    if key.startswith(prefix) and (item[1] is None or item[1] > now)]
+
+    def close(self) -> None:
+        pass
+
+    def _live(self, key: str, now: float) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item[0]
+
+
+class SQLiteState:
+
+    persistent = True
+
+    def __init__(self, path: str, sweep_every: int = 1000) -> None:
+        self._sweep_every = sweep_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute('SELECT value FROM state WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                                   (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, ?)',
+                             (key, value, now + ttl if ttl else None))
+            self._writes += 1
+            if self._writes % self._sweep_every == 0:
+                self._db.execute('DELETE FROM state WHERE expires <= ?', (now,))
+
+    def pop(self, key: str) -> Optional[str]:
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT value FROM state WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                                       (key, time.time())).fetchone()
+                self._db.execute('DELETE FROM state WHERE key = ?', (key,))
+            finally:
+                self._db.execute('COMMIT')
+        return row[0] if row else None
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute('DELETE FROM state WHERE key = ?', (key,))
+
+    def items(self, prefix: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            rows = self._db.execute('SELECT key, value FROM state WHERE substr(key, 1, ?) = ? '
+                                    'AND (expires IS NULL OR expires > ?)', (len(prefix), prefix, time.time()))
+            return rows.fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class RespError(Exception):
+    pass
+
+
+class RespConnection:
+
+    def __init__(self, host: str, port: int, timeout: float = 5.0) -> None:
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile('rb')
+
+    def execute(self, *args) -> object:
+        payload = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            payload.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        self._sock.sendall(b''.join(payload))
+        return self._read()
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+    def _read(self) -> object:
+        line = self._file.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('connection closed by the state server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RespError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._file.read(size + 2)
+            return data[:-2].decode()
+        if kind == b'*':
+            size = int(rest)
+            return None if size < 0 else [self._read() for _ in range(size)]
+        raise RespError(f'unexpected reply {line!r}')
+
+
+class RespState:
+
+    persistent = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 6379, db: int = 0, password: Optional[str] = None,
+                 timeout: float = 5.0) -> None:
+        self._address = (host, port)
+        self._db = db
+        self._password = password
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def get(self, key: str) -> Optional[str]:
+        return self._execute('GET', key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        if ttl:
+            self._execute('SET', key, value, 'PX', max(1, int(ttl * 1000)))
+        else:
+            self._execute('SET', key, value)
+
+    def pop(self, key: str) -> Optional[str]:
+        return self._execute('GETDEL', key)
+
+    def delete(self, key: str) -> None:
+        self._execute('DEL', key)
+
+    def items(self, prefix: str) -> List[Tuple[str, str]]:
+        pattern = ''.join(f'\\{char}' if char in '*?[]\\' else char for char in prefix) + '*'
+        found, cursor = [], '0'
+        while True:
+            cursor, keys = self._execute('SCAN', cursor, 'MATCH', pattern, 'COUNT', 500)
+            if keys:
+                found.extend(item for item in zip(keys, self._execute('MGET', *keys)) if item[1] is not None)
+            if cursor == '0':
+                return found
+
+    def close(self) -> None:
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _execute(self, *args) -> object:
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            try:
+                if connection is None:
+                    connection = self._local.connection = self._connect()
+                return connection.execute(*args)
+            except (ConnectionError, OSError):
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def _connect(self) -> 'RespConnection':
+        connection = RespConnection(*self._address, timeout=self._timeout)
+        if self._password:
+            connection.execute('AUTH', self._password)
+        if self._db:
+            connection.execute('SELECT', self._db)
+        return connection
+
+
+def open_state(url: str):
+    parsed = urlparse(url)
+    if parsed.scheme in ('', 'memory'):
+        return MemoryState()
+    if parsed.scheme == 'sqlite':
+        return SQLiteState(unquote(url[len('sqlite:///'):]) if url.startswith('sqlite:///') else parsed.path)
+    if parsed.scheme == 'redis':
+        return RespState(parsed.hostname or '127.0.0.1', parsed.port or 6379, int(parsed.path.strip('/') or 0),
+                         unquote(parsed.password) if parsed.password else None)
+    raise ValueError(f'unsupported state url {url}')
+
+
+def state_url() -> str:
+    if getenv('state_url'):
+        return getenv('state_url')
+    return f'sqlite:///{getenv("sessions_db")}' if getenv('sessions_db') else 'memory://'
+
+
+state = open_state(state_url())
+shard_index = int(getenv('shard_index', 0))
+shard_count = max(1, int(getenv('shard_count', 1)))
@@ -0,0 +1,68 @@
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import getenv
+from typing import Callable
+
+import speech_recognition as sr
+from dotenv import load_dotenv
+from metrics import speech_seconds
+
+
+load_dotenv('.env')
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+
+class VoiceTooLong(ValueError):
+    pass
+
+
+class RecognizerBusy(RuntimeError):
+    pass
+
+
+class VoiceRecognizer:
+
+    def __init__(self, workers: int = 2, max_bytes: int = 1024 * 1024, max_duration: int = 60,
+                 language: str = 'ru_RU', ffmpeg: str = 'ffmpeg', timeout: float = 30, queue_size: int = 8) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='speech')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._max_bytes = max_bytes
+        self._max_duration = max_duration
+        self._language = language
+        self._ffmpeg = ffmpeg
+        self._recognizer = sr.Recognizer()
+        self._recognizer.operation_timeout = timeout
+
+    def check(self, file_size: int, duration: int) -> None:
+        if (file_size or 0) > self._max_bytes or (duration or 0) > self._max_duration:
+            raise VoiceTooLong(f'voice message {file_size} bytes, {duration} s')
+
+    def decode(self, ogg: bytes) -> 'sr.AudioData':
+        with speech_seconds.time('decode'):
+            result = subprocess.run([self._ffmpeg, '-loglevel', 'quiet', '-i', 'pipe:0', '-t', str(self._max_duration),
+                                     '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1'],
+                                    input=ogg, stdout=subprocess.PIPE, check=True, timeout=30)
+        return sr.AudioData(result.stdout, SAMPLE_RATE, SAMPLE_WIDTH)
+
+    def recognize(self, ogg: bytes) -> str:
+        audio = self.decode(ogg)
+        with speech_seconds.time('recognize'):
+            return self._recognizer.recognize_google(audio, language=self._language)
+
+    def transcribe(self, load: Callable[[], bytes], done: Callable[['Future'], None]) -> 'Future':
+        if not self._slots.acquire(blocking=False):
+            raise RecognizerBusy('too many voice messages in progress')
+        future = self._executor.submit(lambda: self.recognize(load()))
+        future.add_done_callback(lambda _: self._slots.release())
+        future.add_done_callback(done)
+        return future
+
+
+recognizer = VoiceRecognizer(workers=int(getenv('speech_workers', 2)),
+                             max_bytes=int(getenv('voice_max_bytes', 1024 * 1024)),
+                             max_duration=int(getenv('voice_max_duration', 60)),
+                             timeout=float(getenv('speech_timeout', 30)),
+                             queue_size=int(getenv('speech_queue_size', 8)))
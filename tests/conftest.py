@@ -0,0 +1,6 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.update(destinations_db=':memory:', destinations_seed='', quota_db='', cache_db='', state_url='memory://',
+                  sessions_db='', list_parser='json')
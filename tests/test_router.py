@@ -0,0 +1,45 @@
+import telebot
+
+from router import MAX_PAYLOAD, CallbackRouter, PayloadStore
+
+
+def make_router(**kwargs):
+    router = CallbackRouter(telebot.TeleBot('1:test', threaded=False), **kwargs)
+
+    @router.route('r')
+    def page(call, history_id, number):
+        pass
+
+    @router.raw('CALENDAR')
+    def calendar(call):
+        pass
+
+    return router, page, calendar
+
+
+def test_encode_decode_roundtrip():
+    router, page, _ = make_router()
+    data = router.encode('r', 42, 3)
+    assert data == '1r:42:3'
+    assert router.decode(data) == ('r', page, ('42', '3'))
+
+
+def test_long_or_unsafe_args_are_stored():
+    router, page, _ = make_router()
+    long_arg = 'x' * MAX_PAYLOAD
+    for args in ((long_arg, '1'), ('a:b', '1'), ('~1', '2')):
+        data = router.encode('r', *args)
+        assert len(data.encode()) <= MAX_PAYLOAD
+        assert router.decode(data) == ('r', page, args)
+
+
+def test_expired_stored_payload():
+    router, _, _ = make_router(store=PayloadStore(ttl=-1))
+    assert router.decode(router.encode('r', 'a:b', '1')) == ('r', None, ())
+
+
+def test_raw_and_unknown_routes():
+    router, _, calendar = make_router()
+    assert router.decode('CALENDAR:DAY:2022:1:1') == ('CALENDAR', calendar, ())
+    assert router.decode('1z:1') == (None, None, ())
+    assert router.decode('') == (None, None, ())
@@ -0,0 +1,19 @@
+import pytest
+
+from searchrequests import Search
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('100 500', ['100', '500']),
+    ('500 100', ['100', '500']),
+    ('0,5 2', ['0.5', '2']),
+    ('от 1.5 до 3', ['1.5', '3']),
+    ('10 2,5', ['2.5', '10']),
+])
+def test_set_limits(text, expected):
+    assert Search.set_limits(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', '100', '1 2 3', 'abc def', '-1 5', '1,2,3 4'])
+def test_set_limits_rejects(text):
+    assert Search.set_limits(text) == []
@@ -0,0 +1,47 @@
+import math
+
+import pytest
+
+from searchresults import MILE, parse_distance, parse_number, parse_price
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1,234 км', 1.234),
+    ('1,2 км', 1.2),
+    ('12 345,67 ₽', 12345.67),
+    ('12 345 RUB', 12345),
+    ('1.234.567', 1234567),
+    ('1.234,5', 1234.5),
+    ('1.234 RUB', 1.234),
+    ('15', 15),
+    ('$105', 105),
+])
+def test_parse_number_ru(text, expected):
+    assert parse_number(text) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('$1,234', 1234),
+    ('1,234,567', 1234567),
+    ('€87.50', 87.5),
+    ('1,234.5 miles', 1234.5),
+])
+def test_parse_number_en(text, expected):
+    assert parse_number(text, 'en_US') == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('text', [None, '', 'не указано'])
+def test_parse_number_without_digits(text):
+    assert parse_number(text) is None
+
+
+def test_parse_price_keeps_currency():
+    assert parse_price('12 345,67 RUB') == (pytest.approx(12345.67), 'RUB')
+    assert math.isinf(parse_price('не указана')[0])
+
+
+def test_parse_distance_converts_miles():
+    assert parse_distance('1,234 км') == pytest.approx(1.234)
+    assert parse_distance('3,4 мили') == pytest.approx(3.4 * MILE)
+    assert parse_distance('0.8 miles', 'en_US') == pytest.approx(0.8 * MILE)
+    assert math.isinf(parse_distance('не указано'))
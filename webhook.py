@@ -0,0 +1,180 @@
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import signal
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+import telebot
+from metrics import registry
+
+
+logger = logging.getLogger('main_logger')
+_active = None
+
+
+def chat_key(update: Dict) -> int:
+    for kind in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if kind in update:
+            return update[kind]['chat']['id']
+    if 'callback_query' in update:
+        call = update['callback_query']
+        return call['message']['chat']['id'] if 'message' in call else call['from']['id']
+    for kind in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query'):
+        if kind in update:
+            return update[kind]['from']['id']
+    return update.get('update_id', 0)
+
+
+def secret_path(token: str, secret: Optional[str] = None) -> str:
+    return '/webhook/' + (secret or hashlib.sha256(f'webhook:{token}'.encode()).hexdigest()[:32])
+
+
+class UpdateDispatcher:
+
+    def __init__(self, process: Callable[[Dict], None], workers: int = 8, queue_size: int = 1000) -> None:
+        self._process = process
+        self._queues = [queue.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self._lock = threading.Lock()
+        self.stats = {'accepted': 0, 'rejected': 0, 'processed': 0, 'failed': 0, 'max_depth': 0,
+                      'busy_seconds': 0.0}
+        self._threads = [threading.Thread(target=self._work, args=(shard,), name=f'webhook-worker-{i}', daemon=True)
+                         for i, shard in enumerate(self._queues)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, update: Dict) -> bool:
+        return self.call(chat_key(update), self._process, update)
+
+    def call(self, key: int, func: Callable, *args) -> bool:
+        shard = self._queues[hash(key) % len(self._queues)]
+        try:
+            shard.put_nowait((key, func, args))
+        except queue.Full:
+            self._count('rejected')
+            return False
+        with self._lock:
+            self.stats['accepted'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], shard.qsize())
+        return True
+
+    def depth(self) -> int:
+        return sum(shard.qsize() for shard in self._queues)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return dict(self.stats, depth=self.depth(), workers=len(self._threads))
+
+    def shutdown(self, timeout: float = 30) -> None:
+        for shard in self._queues:
+            shard.put(None)
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.time()))
+
+    def _work(self, shard: 'queue.Queue') -> None:
+        while True:
+            item = shard.get()
+            if item is None:
+                return
+            key, func, args = item
+            start = time.perf_counter()
+            try:
+                func(*args)
+                self._count('processed')
+            except Exception as err:
+                logger.error(f'Webhook chat {key}: - {err}')
+                self._count('failed')
+            with self._lock:
+                self.stats['busy_seconds'] += time.perf_counter() - start
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+
+class WebhookServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, path: str, dispatcher: 'UpdateDispatcher',
+                 max_body: int = 1024 * 1024) -> None:
+        self.path = path
+        self.dispatcher = dispatcher
+        self.max_body = max_body
+        super().__init__(address, WebhookHandler)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+
+    server: 'WebhookServer'
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        if not hmac.compare_digest(self.path.encode(), self.server.path.encode()):
+            return self._reply(404)
+        if not length or length > self.server.max_body:
+            return self._reply(413 if length else 400)
+        try:
+            update = json.loads(self.rfile.read(length))
+        except ValueError:
+            return self._reply(400)
+        if not isinstance(update, dict):
+            return self._reply(400)
+        self._reply(200 if self.server.dispatcher.submit(update) else 503)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: bytes = b'', content_type: str = 'text/plain') -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def current_dispatcher() -> Optional['UpdateDispatcher']:
+    return _active
+
+
+def run_webhook(bot: 'telebot.TeleBot', path: str, host: str = '0.0.0.0', port: int = 8443,
+                url: Optional[str] = None, workers: int = 8, queue_size: int = 1000,
+                certificate: Optional[str] = None, private_key: Optional[str] = None) -> None:
+    global _active
+    bot.threaded = False
+    dispatcher = _active = UpdateDispatcher(
+        lambda update: bot.process_new_updates([telebot.types.Update.de_json(update)]), workers, queue_size)
+    registry.collector('webhook', 'Webhook update queue counters.', dispatcher.snapshot)
+    server = WebhookServer((host, port), path, dispatcher)
+    if certificate and private_key:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certificate, private_key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    if url:
+        bot.remove_webhook()
+        if certificate and private_key:
+            with open(certificate, 'r') as cert:
+                bot.set_webhook(url=url.rstrip('/') + path, certificate=cert)
+        else:
+            bot.set_webhook(url=url.rstrip('/') + path)
+
+    def stop(signum, frame) -> None:
+        logger.info(f'Webhook: signal {signum}, shutting down')
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info(f'Webhook: listening on {host}:{port}{path} with {workers} workers')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        dispatcher.shutdown()
+        _active = None
+        logger.info(f'Webhook: stopped, {dispatcher.snapshot()}')